@@ -12,10 +12,114 @@ dollars. This adjustment is "hard-coded" in "scf_data_clean" page 36 of the
 Report found at https://www.federalreserve.gov/publications/files/scf23.pdf
 """
 
-import os
-if not os.path.exists('../main/figures'):
-    os.makedirs('../main/figures')
-
+import argparse, cProfile, tracemalloc
 import scf_data_clean
 import scf_figures
 import scf_lifetime_wealth
+import scf_render
+import scf_profile
+import scf_golden
+import scf_arrow
+
+"""
+Python API. run computes the selected stages ("figures": scf_figures,
+"lifetime": scf_lifetime_wealth) and returns their figure specs, which hold the
+table behind each figure. params overrides the defaults of the stages: years,
+g_list, rf_list, end_date, num and cancel_list. Figures are drawn in out_dir
+unless figures=False, and data is read from and cached in cache_dir. Datasets
+are kept in memory (scf_data_clean.datasets), so later calls in the same process
+skip the cleaning. For example, lifetime wealth for rf=0.05 only:
+
+    run(stages=['lifetime'], params={'rf_list': [0.05]}, figures=False)
+"""
+
+stage_names = ['figures', 'lifetime']
+defaults = {'years': [2019], 'g_list': scf_lifetime_wealth.g_list, 'rf_list': scf_lifetime_wealth.rf_list,
+            'end_date': scf_lifetime_wealth.end_date, 'num': scf_lifetime_wealth.num,
+            'cancel_list': scf_data_clean.cancel_list}
+
+def run(stages=stage_names, params={}, out_dir=scf_render.fig_dir, cache_dir=scf_data_clean.cache_dir,
+        figures=True, fmt='eps', jobs=1, force=False):
+    unknown = set(stages) - set(stage_names) or set(params) - set(defaults)
+    if unknown:
+        raise ValueError("unknown stage or parameter {0}".format(sorted(unknown)))
+    p = dict(defaults, **params)
+    specs = []
+    with scf_profile.stage('main', years=p['years'], jobs=jobs):
+        #prepare all waves concurrently before either stage needs them.
+        scf_data_clean.build_datasets(p['years'], cache_dir)
+        if 'figures' in stages:
+            specs += scf_figures.main(figures=figures, fmt=fmt, jobs=jobs, force=force, years=p['years'],
+                                      cancel_list=p['cancel_list'], fig_dir=out_dir, cache_dir=cache_dir)
+        if 'lifetime' in stages:
+            specs += scf_lifetime_wealth.main(jobs=jobs, figures=figures, fmt=fmt, force=force, years=p['years'],
+                                              g_list=p['g_list'], rf_list=p['rf_list'], end_date=p['end_date'], num=p['num'],
+                                              cancel_list=p['cancel_list'], fig_dir=out_dir, cache_dir=cache_dir)
+    return specs
+
+"""
+Command line. --jobs N draws the figures on N worker processes, --format picks
+the figure format and --no-figures only computes (and prints) the numbers.
+Figures whose inputs have not changed since the last run are skipped unless
+--force is given. --stages,
+--years, --g, --rf, --end-date, --num and --cancel select stages and parameters
+as in run. Everything runs under the __main__ guard so that worker processes
+can import this file, and paths do not depend on the working directory.
+--profile trace.json writes the time, memory and shape of every stage (see
+scf_profile); --cprofile and --tracemalloc also dump a cProfile file (read it
+with pstats) and the largest allocations at the end of the run. --tables PATH
+writes the numbers behind every figure (see scf_golden), and --arrow DIR
+exports the cleaned data of every wave and those tables as Arrow files (see
+scf_arrow).
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create all figures used in the Commentary.')
+    parser.add_argument('--stages', nargs='+', default=stage_names, choices=stage_names, help='stages to run')
+    parser.add_argument('--years', type=int, nargs='+', default=defaults['years'], help='survey waves to process')
+    parser.add_argument('--g', type=float, nargs='+', default=defaults['g_list'], help='aggregate income growth rates')
+    parser.add_argument('--rf', type=float, nargs='+', default=defaults['rf_list'], help='discount rates')
+    parser.add_argument('--end-date', type=int, default=defaults['end_date'], help='age at which lifetime income ends')
+    parser.add_argument('--num', type=int, default=defaults['num'], choices=[5,10], help='number of lifetime wealth qctiles')
+    parser.add_argument('--cancel', type=int, nargs='+', default=defaults['cancel_list'], help='cancellation amounts')
+    parser.add_argument('--out-dir', default=scf_render.fig_dir, help='folder for the figures')
+    parser.add_argument('--cache-dir', default=scf_data_clean.cache_dir, help='folder for downloads and cached data')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--format', default='eps', choices=scf_render.formats, help='figure format')
+    parser.add_argument('--no-figures', dest='figures', action='store_false', help='compute the numbers without drawing figures')
+    parser.add_argument('--force', action='store_true', help='redraw figures even if their inputs have not changed')
+    parser.add_argument('--tables', metavar='PATH', help='write the table behind every figure to PATH')
+    parser.add_argument('--arrow', metavar='DIR', help='export the cleaned data and the figure tables to DIR as Arrow files')
+    parser.add_argument('--profile', metavar='PATH', help='write a JSON trace of every stage to PATH')
+    parser.add_argument('--cprofile', metavar='PATH', help='write cProfile statistics to PATH')
+    parser.add_argument('--tracemalloc', metavar='PATH', help='trace allocations and write the largest to PATH')
+    args = parser.parse_args(argv)
+    if args.profile:
+        scf_profile.enable()
+    if args.tracemalloc:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler:
+        profiler.enable()
+    params = {'years': args.years, 'g_list': args.g, 'rf_list': args.rf, 'end_date': args.end_date,
+              'num': args.num, 'cancel_list': args.cancel}
+    specs = run(args.stages, params, args.out_dir, args.cache_dir, args.figures, args.format, args.jobs, args.force)
+    if args.tables:
+        scf_golden.write_tables(specs, args.tables)
+    if args.arrow:
+        chosen = {year: scf_data_clean.build_dataset(year, args.cache_dir) for year in args.years}
+        scf_arrow.export(specs, {year: ds.data for year, ds in chosen.items()}, args.arrow,
+                         {year: ds.cache_key() for year, ds in chosen.items()})
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+    if args.tracemalloc:
+        with open(args.tracemalloc, 'w') as f:
+            for line in tracemalloc.take_snapshot().statistics('lineno')[:50]:
+                f.write(str(line) + '\n')
+    if args.profile:
+        scf_profile.write_trace(args.profile)
+    return specs
+
+if __name__ == '__main__':
+    main()
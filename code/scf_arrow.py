@@ -0,0 +1,157 @@
+"""
+Export of the cleaned data and of the tables behind the figures as Arrow IPC
+(Feather v2) files, so that other processes can use them without running the
+pipeline:
+
+    python main.py --no-figures --arrow export/
+
+writes export/scf<year>-clean.arrow for every wave and export/tables.arrow.
+
+Files are uncompressed and hold one record batch per table, so a reader that
+memory-maps them gets zero-copy views: opening a file reads only its schema,
+and only the columns (or figure tables) that are used are paged in. The schema
+metadata holds a header (key b'scf') with the format name and version, the kind
+of file, the wave, the number of rows and, for the dataset, the cache key of the
+cleaned frame (see scf_data_clean.Dataset.cache_key).
+
+The dataset keeps the index (yy1, y1) as columns and the qctile categoricals as
+ordered dictionary columns, and Table.to_pandas() gives back the cleaned frame
+exactly. Float columns keep NaN as a value rather than a null, so numeric
+columns have no validity bitmap and are plain arrays.
+
+Figure tables are stored in one file, one record batch per figure with a single
+float column "value" holding the table flattened in C order; the header maps
+each figure name to its batch and shape.
+
+The readers (header, open_dataset, read_columns, table_names, read_table) only
+need numpy and pyarrow: this module imports nothing else at the top, and
+importing it does not load pandas or the pipeline.
+"""
+import os, json, datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc
+
+format_name, format_version = 'scf-arrow', 1
+
+"""
+Writers.
+"""
+
+def _header(kind, **info):
+    return json.dumps(dict(info, format=format_name, version=format_version, kind=kind,
+                           created=datetime.datetime.now(datetime.timezone.utc).isoformat()), default=str)
+
+def _write(table, path):
+    tmp = path + '.tmp'
+    with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+    os.replace(tmp, path)
+
+def write_dataset(data, path, **info):
+    table = pa.Table.from_pandas(data, preserve_index=True)
+    #from_pandas turns NaN into null: store float columns as they are instead.
+    for i, name in enumerate(table.schema.names):
+        if pa.types.is_floating(table.schema.field(name).type):
+            values = np.asarray(data.index.get_level_values(name) if name in data.index.names else data[name])
+            table = table.set_column(i, table.schema.field(name), pa.array(values))
+    header = _header('dataset', rows=len(data), **info)
+    _write(table.replace_schema_metadata(dict(table.schema.metadata, scf=header)), path)
+
+def write_tables(specs, path, **info):
+    figures, batches = {}, []
+    schema = pa.schema([('value', pa.float64())])
+    for k, s in enumerate(specs):
+        table = np.asarray(s['table'], dtype=float)
+        figures[s['name']] = {'batch': k, 'shape': list(table.shape)}
+        batches.append(pa.record_batch([pa.array(table.ravel())], schema=schema))
+    schema = schema.with_metadata({'scf': _header('tables', figures=figures, **info)})
+    tmp = path + '.tmp'
+    with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(tmp, path)
+
+#frames: {year: cleaned frame}, e.g. from scf_data_clean.build_datasets.
+def export(specs, frames, out_dir, cache_keys={}):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for year, data in frames.items():
+        paths.append(os.path.join(out_dir, 'scf{0}-clean.arrow'.format(year)))
+        write_dataset(data, paths[-1], year=year, cache_key=cache_keys.get(year))
+    paths.append(os.path.join(out_dir, 'tables.arrow'))
+    write_tables(specs, paths[-1], years=sorted(frames))
+    return paths
+
+"""
+Readers. Files are memory-mapped, and a file written by another version of this
+format is refused rather than misread.
+"""
+
+def _open(path):
+    return pa.ipc.open_file(pa.memory_map(path, 'r'))
+
+def header(path, reader=None):
+    metadata = (reader or _open(path)).schema.metadata or {}
+    if b'scf' not in metadata:
+        raise ValueError("{0} is not an {1} file".format(path, format_name))
+    info = json.loads(metadata[b'scf'])
+    if info.get('format') != format_name or info.get('version') != format_version:
+        raise ValueError("{0} has format {1} version {2}, expected {3} version {4}".format(
+            path, info.get('format'), info.get('version'), format_name, format_version))
+    return info
+
+#the dataset (or some of its columns) as a pyarrow Table backed by the file.
+def open_dataset(path, columns=None):
+    reader = _open(path)
+    header(path, reader)
+    table = reader.read_all()
+    return table if columns is None else table.select(columns)
+
+"""
+Columns as numpy arrays: numeric columns are views of the file, categorical
+columns are returned as their codes (-1 if missing, as pandas) with their
+categories in a second dict.
+"""
+
+#Array.to_numpy imports pandas, so fixed-width arrays without nulls are viewed
+#through their data buffer directly.
+def _numpy(array):
+    if array.null_count or not (pa.types.is_integer(array.type) or pa.types.is_floating(array.type)):
+        return np.array(array.to_pylist())
+    return _view(array)
+
+def _view(array):
+    dtype = np.dtype(array.type.to_pandas_dtype())
+    if len(array) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.frombuffer(array.buffers()[1], dtype=dtype, count=len(array), offset=array.offset*dtype.itemsize)
+
+#codes of a dictionary column, -1 where null. fill_null would go through
+#pyarrow.compute, which imports pandas: the validity bitmap is read instead.
+def _codes(indices):
+    codes = _view(indices)
+    if not indices.null_count:
+        return codes
+    bits = np.unpackbits(np.frombuffer(indices.buffers()[0], dtype=np.uint8), bitorder='little')
+    return np.where(bits[indices.offset:indices.offset+len(indices)].astype(bool), codes, -1).astype(codes.dtype)
+
+def read_columns(path, columns=None):
+    table = open_dataset(path, columns)
+    arrays, categories = {}, {}
+    for name in table.column_names:
+        column = table.column(name).combine_chunks() if table.column(name).num_chunks != 1 else table.column(name).chunk(0)
+        if pa.types.is_dictionary(column.type):
+            arrays[name] = _codes(column.indices)
+            categories[name] = _numpy(column.dictionary)
+        else:
+            arrays[name] = _numpy(column)
+    return arrays, categories
+
+def table_names(path):
+    return list(header(path)['figures'])
+
+def read_table(path, name):
+    reader = _open(path)
+    figure = header(path, reader)['figures'][name]
+    return _numpy(reader.get_batch(figure['batch']).column(0)).reshape(figure['shape'])
@@ -0,0 +1,129 @@
+"""
+Time each stage of the pipeline on synthetic data (see scf_synthetic), without
+downloading anything. For example
+
+    python scf_benchmark.py --sizes 1000 100000 10000000 --json bench.json
+
+prints the best of --repeat runs of every stage at every size, with the peak
+resident memory of the process so far, and, with --json, writes the timings so
+that runs can be compared over time. Cleaning stages are timed by dropping the
+cached group and building it again.
+
+With --kernels, the kernels of scf_kernels are timed instead, on random inputs of
+--sizes elements (rows for weighted_quantile and group_sums, household-years
+for the multipliers), with every available backend. The first call, which
+includes compiling (or loading the compiled kernel from the disk cache), is
+reported separately:
+
+    python scf_benchmark.py --kernels --sizes 1000000 10000000
+"""
+import time, json, argparse
+import numpy as np
+import scf_data_clean, scf_synthetic, scf_figures, scf_lifetime_wealth, scf_cancellation, scf_profile, scf_kernels
+
+def rebuild(ds, group):
+    ds.__dict__.pop(group, None)
+    return getattr(ds, group)
+
+"""
+Stages: name and function of the synthetic dataset.
+"""
+
+stages = [
+    ('synthetic base', lambda ds: rebuild(ds, 'base')),
+    ('loans', lambda ds: rebuild(ds, 'loans')),
+    ('quantile', lambda ds: scf_data_clean.qctiles(ds.data['income'], ds.data['wgt'], 10)),
+    ('qctiles', lambda ds: rebuild(ds, 'qctiles')),
+    ('cancellations', lambda ds: rebuild(ds, 'cancellations')),
+    ('lifetime_wealth', lambda ds: scf_lifetime_wealth.lifetime_wealth(ds.data, 0, 0.04, 80)),
+    ('lifetime_wealth_grid', lambda ds: scf_lifetime_wealth.lifetime_wealth_grid(ds.data, [0], [0.04,0.07,0.1], [80])),
+    ('percentiles', lambda ds: scf_figures.percentiles(ds.data, 'income')),
+    ('SD_qctiles', lambda ds: scf_figures.SD_qctiles(ds.data)),
+    ('mm_age', lambda ds: scf_figures.mm_age(ds.data, 'income')),
+    ('debt_count', lambda ds: scf_figures.debt_count(ds.data, 'income')),
+    ('cancellation', lambda ds: scf_figures.cancellation(ds.data, 'income')),
+    ('simulate_cancellation', lambda ds: scf_cancellation.simulate_cancellation(ds.data, np.arange(0, 10**5+1, 10**3), [np.inf, 125000])),
+]
+
+def run(sizes, repeat=3, seed=0, only=None):
+    results = []
+    for rows in sizes:
+        ds = scf_synthetic.SyntheticDataset(rows, seed)
+        ds.data
+        #data releases the groups: build them again so that each stage rebuilds its own group only.
+        for group in ds.groups:
+            getattr(ds, group)
+        for name, fun in stages:
+            if only and name not in only:
+                continue
+            times = []
+            for r in range(repeat):
+                tic = time.perf_counter()
+                fun(ds)
+                times.append(time.perf_counter() - tic)
+            results.append({'stage': name, 'rows': len(ds.base), 'seconds': min(times), 'peak_rss_mb': scf_profile.peak_rss()})
+            print("{0:>24} {1:>10} {2:10.4f}s {3:10.1f}MB".format(name, len(ds.base), min(times), scf_profile.peak_rss() or np.nan))
+    return results
+
+"""
+Kernels: name and function of a dict of random inputs with "size" elements.
+"""
+
+def kernel_inputs(size, seed=0, years=79, draws=10):
+    rng = np.random.default_rng(seed)
+    rows = max(size // years, 1)
+    return {'x': rng.lognormal(11, 1, size), 'w': rng.lognormal(8.5, 0.8, size), 'codes': rng.integers(-1, 10, size),
+            'values': rng.normal(size=(size, 3)), 'gr': rng.normal(0.02, 0.01, (rows, years)), 'alive': np.ones((rows, years)),
+            'discount': np.exp(-np.outer(np.arange(years+1), [0.04, 0.07, 0.1])),
+            'shocks': rng.normal(size=(max(rows // draws, 1), draws, years))}
+
+kernels = [
+    ('weighted_quantile', lambda a: scf_kernels.weighted_quantile(a['x'], a['w'], np.arange(11)/10)),
+    ('group_sums', lambda a: scf_kernels.group_sums(a['codes'], a['w'], a['values'], 10)),
+    ('income_multipliers', lambda a: scf_kernels.income_multipliers(a['gr'], a['alive'], a['discount'])),
+    ('shocked_multipliers', lambda a: scf_kernels.shocked_multipliers(a['gr'][:len(a['shocks'])], a['alive'][:len(a['shocks'])],
+                                                                      a['shocks'], 0.1, a['discount'][:,0])),
+]
+
+def run_kernels(sizes, repeat=3, seed=0, only=None):
+    results = []
+    for size in sizes:
+        inputs = kernel_inputs(size, seed)
+        for name, fun in kernels:
+            if only and name not in only:
+                continue
+            seconds = {}
+            for backend in scf_kernels.available():
+                scf_kernels.use(backend)
+                tic = time.perf_counter()
+                fun(inputs)
+                first = time.perf_counter() - tic
+                times = []
+                for r in range(repeat):
+                    tic = time.perf_counter()
+                    fun(inputs)
+                    times.append(time.perf_counter() - tic)
+                seconds[backend] = min(times)
+                results.append({'kernel': name, 'backend': backend, 'size': size, 'seconds': min(times), 'first_call': first})
+                print("{0:>20} {1:>6} {2:>10} {3:10.4f}s (first call {4:.4f}s)".format(name, backend, size, min(times), first))
+            if 'numba' in seconds:
+                print("{0:>20} speedup {1:.1f}x".format(name, seconds['numpy']/seconds['numba']))
+    scf_kernels.use()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the pipeline stages on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10**3, 10**5], help='number of rows (five per household)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage (the best is reported)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', help='stages (or kernels) to run')
+    parser.add_argument('--kernels', action='store_true', help='time the kernels of every backend instead (see scf_kernels)')
+    parser.add_argument('--json', help='file to write the timings to')
+    args = parser.parse_args()
+    if args.kernels:
+        results = run_kernels(args.sizes, args.repeat, args.seed, args.only)
+    else:
+        results = run(args.sizes, args.repeat, args.seed, args.only)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
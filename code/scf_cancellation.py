@@ -0,0 +1,65 @@
+"""
+Student debt cancellation under many policies at once.
+
+A policy is a cap (the most forgiven), an income phase-out threshold (households
+with income above it get nothing) and a rule:
+    borrower: up to the cap is forgiven on the spouse's loans and, separately,
+    up to the cap on the remainder of the household's loans, as for
+    self_cancel/spouse_cancel/percap_cancel in scf_data_clean.
+    household: up to the cap is forgiven on all of the household's loans.
+Forgiveness is in per-capita terms (divide by two if married).
+
+All (cap, phaseout) pairs are evaluated as one broadcast over the household
+arrays, giving a (households x caps x phaseouts) array. simulate_cancellation
+does this for one block of households at a time and adds each block's weighted
+sums by qctile with np.bincount, so memory is bounded by the block size whatever
+the number of households and policies. No columns are added to the data.
+"""
+import numpy as np
+import pandas as pd
+import scf_weighted
+
+rules = ['borrower', 'household']
+
+def forgiveness(data, caps, phaseouts=[np.inf], rule='borrower', phaseout_var='income'):
+    if rule not in rules:
+        raise ValueError("rule must be one of {0}".format(rules))
+    caps, phaseouts = np.asarray(caps, dtype=float), np.asarray(phaseouts, dtype=float)
+    own = np.asarray(data['self_loans'] + data['parent_loans'], dtype=float)[:,None,None]
+    spouse = np.asarray(data['spouse_loans'], dtype=float)[:,None,None]
+    cap = caps[None,:,None]
+    if rule == 'borrower':
+        forgiven = np.minimum(cap, own) + np.minimum(cap, spouse)
+    else:
+        forgiven = np.minimum(cap, own + spouse)
+    eligible = np.asarray(data[phaseout_var], dtype=float)[:,None,None] <= phaseouts[None,None,:]
+    percap = (1 - (np.asarray(data['married'])==1)/2)[:,None,None]
+    return percap*forgiven*eligible
+
+"""
+Weighted mean per-capita forgiveness for each policy (rows, indexed by cap and
+phaseout) and each category of "by" (columns), e.g. per-capita income quintiles.
+"""
+
+#block_size: (households x policies) elements evaluated at a time.
+def simulate_cancellation(data, caps, phaseouts=[np.inf], rule='borrower', by='percap_income_cat5', phaseout_var='income', weight='wgt',
+                          block_size=2**20):
+    codes, index = scf_weighted.group_index(data, by)
+    rows = np.flatnonzero(codes >= 0)
+    needed = ['self_loans', 'parent_loans', 'spouse_loans', 'married', phaseout_var]
+    columns = {col: np.asarray(data[col])[rows] for col in needed}
+    codes, w = codes[rows], np.asarray(data[weight], dtype=float)[rows]
+    G, P = len(index), len(caps)*len(phaseouts)
+    sums = np.zeros(G*P)
+    step = max(block_size // P, 1)
+    for a in range(0, len(rows), step):
+        block = {col: values[a:a+step] for col, values in columns.items()}
+        F = forgiveness(block, caps, phaseouts, rule, phaseout_var).reshape(-1, P)
+        #one bincount over (group, policy) cells.
+        cells = (codes[a:a+step, None]*P + np.arange(P)).ravel()
+        sums += np.bincount(cells, weights=(w[a:a+step, None]*F).ravel(), minlength=G*P)
+    total = np.bincount(codes, weights=w, minlength=G)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table = sums.reshape(G, P)/total[:,None]
+    policies = pd.MultiIndex.from_product([np.asarray(caps), np.asarray(phaseouts)], names=['cap', 'phaseout'])
+    return pd.DataFrame(table.T, index=policies, columns=index)
@@ -9,13 +9,14 @@ recorded in per-capita terms (divide by two if married).
 """
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import matplotlib as mpl
 import time, datetime, sys, os
-from io import BytesIO
+import hashlib, json, threading, tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
-import requests, zipfile
-from urllib.request import urlopen
+import requests
+import scf_profile, scf_kernels
 
 """
 January 2024: the latest version of the 2019 summary SCF file was released in
@@ -32,51 +33,188 @@ Report found at https://www.federalreserve.gov/publications/files/scf23.pdf
 asset_adj = 1.1592
 
 """
-Following suppresses a Python warning about defining too many variables
-(taken from https://github.com/twopirllc/pandas-ta/issues/340)
+Function that fetches the data.
+
+Archives are cached in cache_dir under the SHA-256 of their content, and an
+index (cache_index.json) maps each URL to the hash of the archive last fetched
+from it. A URL found in the index is never downloaded again. The parsed frame
+is also stored as Parquet next to the archive, so later runs skip read_stata.
+In offline mode (set SCF_OFFLINE=1) only the cache is read and a missing URL
+raises immediately rather than attempting the network.
+
+Downloads are streamed to a .part file in chunks (hashing as they go), so the
+archive is never held in memory, and an interrupted download resumes from the
+end of the .part file with an HTTP Range request. The server's ETag (or
+Last-Modified date) is kept next to the .part file and sent as If-Range, so a
+file changed on the server is downloaded again from the start rather than
+appended to the old bytes. Progress and throughput are printed every few seconds.
 """
 
-from warnings import simplefilter
-simplefilter(action="ignore", category=pd.errors.PerformanceWarning)
+#paths are relative to the repository, not to the working directory.
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+cache_dir = os.path.join(root, 'data')
+offline = os.environ.get('SCF_OFFLINE', '0') == '1'
+
+#archives may be fetched from several threads (see build_datasets): the index is
+#read, and re-read and rewritten, under this lock so that no thread drops
+#another's entry. It is replaced atomically, so other processes never see a
+#partly written file either.
+index_lock = threading.RLock()
+
+def cache_index(cache_dir=cache_dir):
+    path = os.path.join(cache_dir, 'cache_index.json')
+    with index_lock:
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+def write_index(index, cache_dir=cache_dir):
+    with index_lock:
+        with tempfile.NamedTemporaryFile('w', dir=cache_dir, suffix='.tmp', delete=False) as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(f.name, os.path.join(cache_dir, 'cache_index.json'))
+
+def hash_file(path, chunk_size=2**16):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            h.update(block)
+    return h
+
+def download(url, cache_dir=cache_dir, chunk_size=2**16, report_every=5):
+    part = os.path.join(cache_dir, hashlib.sha256(url.encode()).hexdigest()[:16] + '.part')
+    done = os.path.getsize(part) if os.path.exists(part) else 0
+    #a .part file without a validator cannot be checked against the server: start again.
+    validator = None
+    if done and os.path.exists(part + '.validator'):
+        with open(part + '.validator') as f:
+            validator = f.read()
+    headers = {'Range': 'bytes={0}-'.format(done), 'If-Range': validator} if validator else {}
+    with requests.get(url, stream=True, headers=headers, timeout=60) as r:
+        if r.status_code == 416:
+            #nothing left past the end of the .part file: it is complete if it has
+            #the size of the file on the server, and out of date otherwise.
+            if r.headers.get('Content-Range') == 'bytes */{0}'.format(done):
+                return part, hash_file(part, chunk_size).hexdigest(), done
+            os.remove(part)
+            return download(url, cache_dir, chunk_size, report_every)
+        r.raise_for_status()
+        if r.status_code == 206:
+            #resuming: hash what is already on disk.
+            h = hash_file(part, chunk_size)
+        else:
+            h, done = hashlib.sha256(), 0
+            #If-Range needs a strong validator, so weak ETags fall back to the date.
+            etag = r.headers.get('ETag', 'W/')
+            validator = etag if not etag.startswith('W/') else r.headers.get('Last-Modified')
+            with open(part + '.validator', 'w') as f:
+                f.write(validator or '')
+        total = done + int(r.headers.get('Content-Length', 0)) or None
+        tic = last = time.time()
+        resumed = done
+        with open(part, 'ab' if done else 'wb') as f:
+            for block in r.iter_content(chunk_size):
+                f.write(block)
+                h.update(block)
+                done += len(block)
+                if time.time() - last > report_every:
+                    last = time.time()
+                    print("{0}: {1:.1f} of {2} MB ({3:.1f} MB/s)".format(url, done/2**20,
+                          '{0:.1f}'.format(total/2**20) if total else '?', (done-resumed)/2**20/(last-tic)))
+    print("Downloaded {0}: {1:.1f} MB in {2:.1f}s".format(url, done/2**20, time.time()-tic))
+    return part, h.hexdigest(), done
+
+def cached_archive(url, cache_dir=cache_dir, offline=offline):
+    index = cache_index(cache_dir)
+    if url in index:
+        path = os.path.join(cache_dir, index[url]['sha256'] + '.zip')
+        if os.path.exists(path):
+            return path, index[url]['sha256']
+    if offline:
+        raise FileNotFoundError("{0} is not in the cache at {1} and offline mode is set".format(url, cache_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+    with scf_profile.stage('download', url=url) as record:
+        part, sha256, record['bytes'] = download(url, cache_dir)
+    path = os.path.join(cache_dir, sha256 + '.zip')
+    os.replace(part, path)
+    os.remove(part + '.validator')
+    with index_lock:
+        index = cache_index(cache_dir)
+        index[url] = {'sha256': sha256, 'member': ZipFile(path).namelist()[0]}
+        write_index(index, cache_dir)
+    return path, sha256
+
+#fetch several archives at once (e.g. the summary and full files of a wave).
+def fetch_archives(urls, cache_dir=cache_dir, offline=offline):
+    with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+        return list(pool.map(lambda url: cached_archive(url, cache_dir, offline), urls))
+
+def data_from_url(url, columns=None, dtypes={}, chunksize=10**4, cache_dir=cache_dir, offline=offline):
+    path, sha256 = cached_archive(url, cache_dir, offline)
+    #one Parquet file per column selection, so a projected read never serves a wider one.
+    key = sha256 if columns is None else sha256 + '-' + hashlib.sha256(','.join(columns).encode()).hexdigest()[:12]
+    frame_path = os.path.join(cache_dir, key + '.parquet')
+    if os.path.exists(frame_path):
+        return pd.read_parquet(frame_path)
+    #read only the requested columns, chunksize rows at a time, narrowing each chunk
+    #before the next is parsed so that the full-width frame is never held in memory.
+    #The .dta is decompressed straight from the zip member: no extracted copy.
+    chunks = []
+    with scf_profile.stage('read_stata', url=url) as record:
+        with ZipFile(path) as z, z.open(z.namelist()[0]) as member:
+            with pd.read_stata(member, columns=columns, chunksize=chunksize) as reader:
+                for chunk in reader:
+                    chunks.append(chunk.astype({k: v for k, v in dtypes.items() if k in chunk.columns}))
+        df = record.shape(pd.concat(chunks, ignore_index=True))
+    #Parquet needs pyarrow (or fastparquet); without it we just re-parse next time.
+    try:
+        df.to_parquet(frame_path)
+    except ImportError:
+        pass
+    return df
 
 """
-Make folder for figures and data if none exists
+Compact column types. Integer-valued float columns (counts, codes and whole
+dollar amounts stored as doubles in the Stata files) become the smallest integer
+type holding them, as do wide integer columns. Other floats are left as float64
+so that every figure is unchanged. Categoricals already hold int8 codes.
 """
-if not os.path.exists('../main/figures'):
-    os.makedirs('../main/figures')
 
-if not os.path.exists('../data'):
-    os.makedirs('../data')
+def compact(df):
+    types = {}
+    for col in df.columns:
+        values = df[col].values
+        if not isinstance(values, np.ndarray) or values.dtype.kind not in 'if' or len(values) == 0:
+            continue
+        if values.dtype.kind == 'f' and not (np.isfinite(values).all() and (values == np.round(values)).all()):
+            continue
+        for t in [np.int8, np.int16, np.int32]:
+            if values.min() >= np.iinfo(t).min and values.max() <= np.iinfo(t).max:
+                if np.dtype(t).itemsize < values.dtype.itemsize:
+                    types[col] = t
+                break
+    return df.astype(types)
 
 """
-Function that fetches the data
+Parquet with categoricals stored as their codes and the categories in a .json
+file next to it, since not every pandas/pyarrow pair restores ordered
+categoricals with integer categories.
 """
 
-def data_from_url(url):
-    r = requests.get(url, stream=True)
-    z = zipfile.ZipFile(BytesIO(r.content))
-    z.extractall('../data/')
-    return pd.read_stata('../data/{0}'.format(z.namelist()[0]))
+def write_frame(df, path):
+    cats = {col: {'categories': df[col].cat.categories.tolist(), 'ordered': bool(df[col].cat.ordered)}
+            for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    df.assign(**{col: df[col].cat.codes for col in cats}).to_parquet(path)
+    with open(path + '.json', 'w') as f:
+        json.dump(cats, f)
 
-"""
-Download summary dataset and full public dataset
-"""
-
-tic = time.time()
-url = 'https://www.federalreserve.gov/econres/files/scfp2019s.zip'
-rscfp2019 = data_from_url(url)
-toc = time.time()
-print("Time to download summary dataset rscfp2019:", toc-tic)
-
-tic = time.time()
-url = 'https://www.federalreserve.gov/econres/files/scf2019s.zip'
-p19i6 = data_from_url(url)
-toc = time.time()
-print("Time to download full public dataset p19i6:", toc-tic)
-
-"""
-List variables to keep, and join full public and summary dataset as "data"
-"""
+def read_frame(path):
+    df = pd.read_parquet(path)
+    with open(path + '.json') as f:
+        cats = json.load(f)
+    return df.assign(**{col: pd.Categorical.from_codes(df[col], categories=cat['categories'], ordered=cat['ordered'])
+                        for col, cat in cats.items()})
 
 """
 Variables and questions for student debt
@@ -88,12 +226,115 @@ whom_list = ['x7978', 'x7883', 'x7888', 'x7893', 'x7898', 'x7993']
 #How much is still owed on this loan? 0=NA/Inappropriate, otherwise dollar amount
 bal_list = ['x7824', 'x7847', 'x7870', 'x7924', 'x7947', 'x7970']
 
-var_list_p19i6 = ['yy1','y1','x7978','x7883','x7888','x7893','x7898','x7993',
-'x7824','x7847','x7870','x7924','x7947','x7970']
-p19i6 = p19i6[var_list_p19i6]
-p19i6.set_index(['yy1','y1'],inplace=True)
-rscfp2019.set_index(['yy1','y1'],inplace=True)
-data = p19i6.join(rscfp2019, how='inner')
+"""
+Loans in long form: one row per (household, loan slot) with a positive balance,
+holding the row of the household, the slot (0-5), the "whom" code and the
+balance. Totals and counts by type of borrower are then a single bincount over
+household*types + type. borrower_types maps each type to its "whom" codes
+(parent and grandparent are absorbed into "parent"); loans of other relatives
+or others belong to no type. "values" replaces the balances, e.g.
+np.minimum(table['balance'], cap) for a per-loan cap.
+"""
+
+borrower_types = {'self': [1], 'spouse': [2], 'parent': [3,4]}
+
+def loan_table(df, whom_list=whom_list, bal_list=bal_list):
+    whom = np.column_stack([np.asarray(df[var]) for var in whom_list])
+    bal = np.column_stack([np.asarray(df[var]) for var in bal_list])
+    household, slot = np.nonzero(bal > 0)
+    return pd.DataFrame({'household': household.astype(np.int32), 'slot': slot.astype(np.int8),
+                         'whom': whom[household, slot].astype(np.int8), 'balance': bal[household, slot]})
+
+def borrower_type(whom, types=borrower_types):
+    codes = np.full(len(whom), -1)
+    for k, whoms in enumerate(types.values()):
+        codes[np.isin(whom, whoms)] = k
+    return codes
+
+def loan_totals(table, households, types=borrower_types, values=None):
+    codes, K = borrower_type(table['whom'], types), len(types)
+    keep = codes >= 0
+    values = np.asarray(table['balance'] if values is None else values, dtype=float)
+    flat = np.asarray(table['household'])[keep]*K + codes[keep]
+    return np.bincount(flat, weights=values[keep], minlength=households*K).reshape(households, K)
+
+def loan_counts(table, households, types=borrower_types):
+    return loan_totals(table, households, types, np.ones(len(table)))
+
+"""
+Configuration of each survey wave: URLs of the summary and full public files,
+the loan variable codes and the factor converting the summary file's dollars
+to dollars of the survey year (see asset_adj above).
+
+The summary files of every wave are now released in 2022 dollars, so the factor
+is 1 for 2022 and 1.1592 for 2019. The other waves are registered without one:
+their factor is read off the data when they are loaded (see loan_factor). The
+loan questions are assumed to keep their 2019 codes, which loan_factor checks
+against the data of each wave.
+"""
+
+waves = {}
+
+#SCF_BASE_URL points the default URLs elsewhere, e.g. at a local mirror or the
+#stand-in server of scf_http_fixture.
+base_url = os.environ.get('SCF_BASE_URL', 'https://www.federalreserve.gov/econres/files/')
+
+def register_wave(year, asset_adj=None, whom=whom_list, bal=bal_list, summary=None, full=None):
+    waves[year] = {'summary': summary or base_url + 'scfp{0}s.zip'.format(year),
+                   'full': full or base_url + 'scf{0}s.zip'.format(year),
+                   'whom': list(whom), 'bal': list(bal), 'asset_adj': asset_adj}
+
+for wave_year in range(2004, 2023, 3):
+    register_wave(wave_year)
+register_wave(2019, asset_adj)
+register_wave(2022, 1.0)
+
+def wave(year):
+    if year not in waves:
+        raise KeyError("no configuration for the {0} wave (known: {1})".format(year, sorted(waves)))
+    return waves[year]
+
+"""
+The summary file's edn_inst is the sum of the loan balances of the full public
+file, converted to 2022 dollars, so for every borrower edn_inst over the sum of
+the wave's "bal" columns is the wave's factor. loan_factor returns the median of
+these ratios (rounded as in the Report) for a wave registered without a factor,
+and the registered factor otherwise. It raises if the ratios disagree, or if
+the median is not the registered factor: the balance codes (or the factor) are
+then not this wave's. A "whom" code outside those listed above means the same
+for the "whom" codes.
+"""
+
+whom_codes = [-7, 0, 1, 2, 3, 4, 5]
+
+def loan_factor(df, year, rtol=0.005, share=0.9):
+    whom, bal, factor = wave(year)['whom'], wave(year)['bal'], wave(year)['asset_adj']
+    unknown = sorted(set(np.unique(df[whom].values).tolist()) - set(whom_codes))
+    if unknown:
+        raise ValueError("codes {0} in {1} of the {2} wave are not loan codes: check them against its codebook".format(unknown, whom, year))
+    total = df[bal].clip(lower=0).sum(axis=1).values
+    ratio = df['edn_inst'].values[total > 0]/total[total > 0]
+    median = np.median(ratio)
+    if np.mean(np.abs(ratio/median - 1) <= rtol) < share:
+        raise ValueError("{0} of the {1} wave do not add up to edn_inst: check them against its codebook".format(bal, year))
+    if factor is None:
+        return round(median, 4)
+    if abs(median/factor - 1) > rtol:
+        raise ValueError("edn_inst gives a factor of {0:.4f} for the {1} wave, not {2}".format(median, year, factor))
+    return factor
+
+#Columns read from the full public file, and their types: "whom" codes fit in
+#int8 and balances are whole dollars, so int32 is exact.
+def full_columns(year):
+    return ['yy1','y1'] + wave(year)['whom'] + wave(year)['bal']
+
+def full_dtypes(year):
+    dtypes = {'yy1':'int32', 'y1':'int32'}
+    dtypes.update({var:'int8' for var in wave(year)['whom']})
+    dtypes.update({var:'int32' for var in wave(year)['bal']})
+    return dtypes
+
+var_list_p19i6, dtypes_p19i6 = full_columns(2019), full_dtypes(2019)
 
 """
 Debt lists and debt brackets
@@ -112,88 +353,338 @@ def colorFader(c1,c2,mix):
     return mpl.colors.to_hex((1-mix)*np.array(mpl.colors.to_rgb(c1)) + mix*np.array(mpl.colors.to_rgb(c2)))
 
 #Weighted quantile function (basically interpolates the CDF to create quantiles).
+#quantile may be a scalar or an array: all quantiles are read off a single sort.
 def quantile(data, weights, quantile):
     if not isinstance(data, np.matrix):
         data = np.asarray(data)
     if not isinstance(weights, np.matrix):
         weights = np.asarray(weights)
-    ind_sorted = np.argsort(data) #argsort gets the indices that sort the given array
-    sorted_weights = weights[ind_sorted]
-    #sorted_weights will form x values of CDF.
-    Sn = np.cumsum(sorted_weights)
-    #Sn is candidate y values of CDF.
-    Pn = Sn/Sn[-1] #alternative: Pn = (Sn-0.5*sorted_weights)/Sn[-1]
-    return np.interp(quantile, Pn, data[ind_sorted]) #syntax: x, xp, fp. i.e CDF is fp at xp.
+    #argsort gets the indices that sort the given array. A stable sort keeps tied values
+    #in their original order: the interpolated CDF depends on that order at ties, and
+    #the default quicksort's order varies with the numpy build. The cumulative sorted
+    #weights Sn/Sn[-1] are the CDF, interpolated at quantile (see scf_kernels).
+    #alternative: Pn = (Sn-0.5*sorted_weights)/Sn[-1]
+    return scf_kernels.weighted_quantile(data, weights, quantile)
+
+#All quantiles qctiles(num) = 0, 1/num, ..., 1 (deciles, quintiles) in one call.
+def qctiles(data, weights, num):
+    return quantile(data, weights, np.arange(num+1)/num)
+
+"""
+Weighted quantiles for every group at once. groups holds integer codes
+0,...,ngroups-1 (negative codes, e.g. pandas' -1 for NaN, are dropped). Returns an
+(ngroups x len(quantile)) array equal to calling quantile on each group, with NaN
+rows for empty groups.
+
+One sort by (group, value) gives every group's CDF through a segmented cumsum.
+Rather than interpolating group by group, the quantiles are merged into the
+sorted CDF values with a second sort, which gives for each (group, quantile) the
+first point of the group's CDF lying above it; the interpolation then follows
+np.interp exactly.
+"""
+
+def grouped_quantile(data, weights, groups, quantile, ngroups=None):
+    data, weights, groups = np.asarray(data, dtype=float), np.asarray(weights, dtype=float), np.asarray(groups)
+    q = np.atleast_1d(np.asarray(quantile, dtype=float))
+    keep = groups >= 0
+    data, weights, groups = data[keep], weights[keep], groups[keep].astype(np.int64)
+    if ngroups is None:
+        ngroups = groups.max() + 1 if len(groups) else 0
+    order = np.lexsort((data, groups))
+    x, w, g = data[order], weights[order], groups[order]
+    start = np.searchsorted(g, np.arange(ngroups), side='left')
+    end = np.searchsorted(g, np.arange(ngroups), side='right')
+    #segmented cumsum: subtract the running total at the start of each group.
+    Sn = np.cumsum(w)
+    offset = np.concatenate(([0], Sn))[start]
+    total = np.concatenate(([0], Sn))[end] - offset
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Pn = (Sn - offset[g])/total[g]
+    #merge (group, q) targets into the sorted (group, Pn) points. Points sort before
+    #targets on ties, so the number of points before a target is the index of the
+    #first point of its group with Pn > q.
+    tg, tq = np.repeat(np.arange(ngroups), len(q)), np.tile(q, ngroups)
+    keys_g, keys_p = np.concatenate((g, tg)), np.concatenate((Pn, tq))
+    is_target = np.concatenate((np.zeros(len(g), dtype=bool), np.ones(len(tg), dtype=bool)))
+    merged = np.lexsort((is_target, keys_p, keys_g))
+    points_before = np.cumsum(~is_target[merged])
+    hi = np.empty(len(tg), dtype=np.int64)
+    hi[merged[is_target[merged]] - len(g)] = points_before[is_target[merged]]
+    lo = hi - 1
+    s, e = start[tg], end[tg]
+    #np.interp: below the first point return its value, at or above the last return the last.
+    out = np.full(len(tg), np.nan)
+    first, last = hi <= s, (hi >= e) & (e > s)
+    mid = ~first & ~last & (e > s)
+    out[first & (e > s)] = x[s[first & (e > s)]]
+    out[last] = x[e[last] - 1]
+    slope = (x[hi[mid]] - x[lo[mid]])/(Pn[hi[mid]] - Pn[lo[mid]])
+    out[mid] = slope*(tq[mid] - Pn[lo[mid]]) + x[lo[mid]]
+    return out.reshape(ngroups, len(q))
+
+"""
+pd.cut of each row against the bins of its own group (bins is the output of
+grouped_quantile). Intervals are closed on the right; include_lowest also puts
+the lowest bin edge in the first bin. Rows outside their group's bins, or in a
+negative group, get NaN.
+"""
+
+def grouped_cut(data, groups, bins, include_lowest=False):
+    data, groups = np.asarray(data, dtype=float), np.asarray(groups)
+    num = bins.shape[1] - 1
+    row_bins = bins[np.where(groups >= 0, groups, 0)]
+    codes = (data[:,None] > row_bins).sum(axis=1) - 1
+    if include_lowest:
+        codes[data == row_bins[:,0]] = 0
+    codes[(codes < 0) | (codes >= num) | (groups < 0) | np.isnan(row_bins).any(axis=1)] = -1
+    return pd.Categorical.from_codes(codes, categories=range(num), ordered=True)
 
 slice_fun = {}
 slice_fun['Borrowers'] = lambda df: df[df['percap_all_loans']>0]
 slice_fun['All'] = lambda df: df
 
 """
-Loans (parent and grandparent absorbed into "parent" category) and categorical age variable
+Age brackets
+"""
+
+age_labels = ["-25","26-30","31-35","36-40","41-45","46-50","51-55","56-60","61+"]
+age_values = [0,25,30,35,40,45,50,55,60,np.inf]
 
-The following need no adjustment because they are already in 2019 dollars.
+"""
+Download summary dataset and full public dataset (only the loan variables
+of the latter are read) and join them.
 """
 
-for i in range(6):
-    data['self_loan{0}'.format(i+1)] = data[bal_list[i]]*(data[whom_list[i]]==1)
-    data['spouse_loan{0}'.format(i+1)] = data[bal_list[i]]*(data[whom_list[i]]==2)
-    data['parent_loan{0}'.format(i+1)] = data[bal_list[i]]*data[whom_list[i]].isin([3,4])
-data['self_loans'] = data[['self_loan{0}'.format(i+1) for i in range(6)]].sum(axis=1)
-data['spouse_loans'] = data[['spouse_loan{0}'.format(i+1) for i in range(6)]].sum(axis=1)
-data['parent_loans'] = data[['parent_loan{0}'.format(i+1) for i in range(6)]].sum(axis=1)
-data['all_loans'] = data['self_loans'] + data['spouse_loans'] + data['parent_loans']
+def load_raw(year=2019, cache_dir=cache_dir, offline=offline):
+    fetch_archives([wave(year)['summary'], wave(year)['full']], cache_dir, offline)
+    tic = time.time()
+    rscfp2019 = data_from_url(wave(year)['summary'], cache_dir=cache_dir, offline=offline)
+    toc = time.time()
+    print("Time to download summary dataset ({0}):".format(year), toc-tic)
+
+    tic = time.time()
+    p19i6 = data_from_url(wave(year)['full'], columns=full_columns(year), dtypes=full_dtypes(year), cache_dir=cache_dir, offline=offline)
+    toc = time.time()
+    print("Time to download full public dataset ({0}):".format(year), toc-tic)
+
+    p19i6.set_index(['yy1','y1'],inplace=True)
+    rscfp2019.set_index(['yy1','y1'],inplace=True)
+    return p19i6.join(rscfp2019, how='inner')
 
 """
-Adjust income, networth, assets and wageinc to be in 2019 dollars and define
-per-capita quantities
+Cached groups of a Dataset. functools.cached_property (up to Python 3.11) holds
+one lock for the whole class while it computes, so that two datasets building
+on different threads (build_datasets) would wait for each other. "cached" keeps
+the value in the instance's __dict__ under the property's name, as
+cached_property does, but locks per instance: a dataset's groups are computed
+once, and different datasets are built concurrently. The lock is re-entrant
+because a group reads the groups it depends on.
 """
 
-data['income'] = data['income']/asset_adj
-data['networth'] = data['networth']/asset_adj
-data['asset'] = data['asset']/asset_adj
-data['wageinc'] = data['wageinc']/asset_adj
-for var in ['all_loans','wageinc','income','asset','networth']:
-    data['percap_' + var] = (1 - (data['married']==1)/2)*data[var]
+class cached:
+    new_lock = threading.Lock()
+
+    def __init__(self, func):
+        self.func, self.name = func, func.__name__
+        functools.update_wrapper(self, func)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def lock(self, instance):
+        with cached.new_lock:
+            return instance.__dict__.setdefault('_cached_lock', threading.RLock())
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self.lock(instance):
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.func(instance)
+            return instance.__dict__[self.name]
 
 """
-Define age brackets and categorical variables
+The dataset used in the Commentary. Nothing is downloaded or computed when the
+object is created: each group of derived columns is a cached property built on
+first access from the groups it depends on, so e.g. asking for the loan totals
+never triggers the quantile categories. "data" joins all groups into the single
+frame used by scf_figures and scf_lifetime_wealth.
 """
 
-age_labels = ["-25","26-30","31-35","36-40","41-45","46-50","51-55","56-60","61+"]
-age_values = [0,25,30,35,40,45,50,55,60,np.Inf]
-#remember pd.cut does not include the left-hand point in the bracket
-#i.e. 35 in the above is in the THIRD bracket (age_cat = 2).
-data['age_cat'] = pd.cut(data['age'],bins=age_values,labels=range(len(age_values)-1))
-
-"""
-Deciles and quintiles for networth and income for whole population and by age.
-Sometimes need duplicates='drop' as argument of pd.cut if qctiles not unique.
-"""
-
-for var in ["income", "networth"]:
-    for num in [10,5]:
-        #var+'_cat{0}' will begin at zero. qctiles inclusive of endpoints.
-        qctiles = np.array([quantile(data[var], data['wgt'], j/num) for j in range(num+1)])
-        data[var+'_cat{0}'.format(num)] = pd.cut(data[var], bins=qctiles, labels=range(len(qctiles)-1),include_lowest=True, duplicates='drop')
-        qctiles = np.array([quantile(data['percap_'+var], data['wgt'], j/num) for j in range(num+1)])
-        data['percap_'+var+'_cat{0}'.format(num)] = pd.cut(data['percap_'+var], bins=qctiles, labels=range(len(qctiles)-1),include_lowest=True, duplicates='drop')
-        #age-specific quantiles
-        for age_cat in range(len(age_labels)):
-            data_temp = data[data['age_cat']==age_cat]
-            qctiles = np.array([quantile(data_temp[var], data_temp['wgt'], j/num) for j in range(num+1)])
-            data[var+'_cat{0}{1}'.format(num,age_cat)] = pd.cut(data_temp[var], bins=qctiles, labels=range(len(qctiles)-1),include_lowest=True)
-            qctiles = np.array([quantile(data_temp['percap_'+var], data_temp['wgt'], j/num) for j in range(num+1)])
-            data['percap_'+var+'_cat{0}{1}'.format(num,age_cat)] = pd.cut(data_temp['percap_'+var],bins=qctiles,labels=range(len(qctiles)-1))
-
-"""
-Cancelled quantities. The text describes these as "per borrower." In the following,
-we therefore cancel up to the amount "cancel" of the spouses loans, and up to
-the amount "cancel" of the remainder of the household loans to obtain a measure
-of cancellation for the household, and then adjust for per-capita.
-"""
-
-for cancel in cancel_list:
-    data['self_cancel{0}'.format(cancel)] = np.minimum(cancel, data['self_loans'] + data['parent_loans'])
-    data['spouse_cancel{0}'.format(cancel)] = np.minimum(cancel, data['spouse_loans'])
-    data['percap_cancel{0}'.format(cancel)] = (1 - (data['married']==1)/2)*(data['self_cancel{0}'.format(cancel)] + data['spouse_cancel{0}'.format(cancel)])
+class Dataset:
+    def __init__(self, year=2019, cache_dir=cache_dir, offline=offline):
+        self.year, self.cache_dir, self.offline = year, cache_dir, offline
+
+    """
+    Joined data with income, networth, assets and wageinc in dollars of the
+    survey year (2019 dollars for the 2019 wave).
+    """
+    @cached
+    @scf_profile.profiled('clean.base')
+    def base(self):
+        df = load_raw(self.year, self.cache_dir, self.offline)
+        factor = loan_factor(df, self.year)
+        for var in ['income','networth','asset','wageinc']:
+            df[var] = df[var]/factor
+        return df
+
+    """
+    Loans (parent and grandparent absorbed into "parent" category). These need
+    no adjustment because they are already in 2019 dollars. loan_table is the
+    long form of the six loans of each household.
+    """
+    @cached
+    @scf_profile.profiled('clean.loan_table')
+    def loan_table(self):
+        return loan_table(self.base, wave(self.year)['whom'], wave(self.year)['bal'])
+
+    @cached
+    @scf_profile.profiled('clean.loans')
+    def loans(self):
+        totals = loan_totals(self.loan_table, len(self.base))
+        loans = pd.DataFrame(totals, index=self.base.index, columns=[t + '_loans' for t in borrower_types])
+        loans['all_loans'] = totals.sum(axis=1)
+        return loans
+
+    """
+    Per-capita quantities (divide by two if married).
+    """
+    @cached
+    @scf_profile.profiled('clean.percap')
+    def percap(self):
+        df, percap = self.base, {}
+        for var in ['all_loans','wageinc','income','asset','networth']:
+            values = self.loans[var] if var == 'all_loans' else df[var]
+            percap['percap_' + var] = (1 - (df['married']==1)/2)*values
+        return pd.DataFrame(percap)
+
+    """
+    Categorical age variable. Remember pd.cut does not include the left-hand
+    point in the bracket, i.e. 35 is in the THIRD bracket (age_cat = 2).
+    """
+    @cached
+    @scf_profile.profiled('clean.age')
+    def age(self):
+        return pd.DataFrame({'age_cat': pd.cut(self.base['age'],bins=age_values,labels=range(len(age_values)-1))})
+
+    """
+    Deciles and quintiles for networth and income for whole population and by age.
+    Sometimes need duplicates='drop' as argument of pd.cut if qctiles not unique.
+    """
+    @cached
+    @scf_profile.profiled('clean.qctiles')
+    def qctiles(self):
+        df = pd.concat([self.base[['income','networth','wgt']], self.percap, self.age], axis=1)
+        cats, age_codes = {}, df['age_cat'].cat.codes.values
+        for var in ["income", "networth"]:
+            for num in [10,5]:
+                #var+'_cat{0}' will begin at zero. qctiles inclusive of endpoints.
+                bins = qctiles(df[var], df['wgt'], num)
+                cats[var+'_cat{0}'.format(num)] = pd.cut(df[var], bins=bins, labels=range(len(bins)-1),include_lowest=True, duplicates='drop')
+                bins = qctiles(df['percap_'+var], df['wgt'], num)
+                cats['percap_'+var+'_cat{0}'.format(num)] = pd.cut(df['percap_'+var], bins=bins, labels=range(len(bins)-1),include_lowest=True, duplicates='drop')
+                #age-specific quantiles, for all age brackets from one sort.
+                bins = grouped_quantile(df[var], df['wgt'], age_codes, np.arange(num+1)/num, len(age_labels))
+                bins_percap = grouped_quantile(df['percap_'+var], df['wgt'], age_codes, np.arange(num+1)/num, len(age_labels))
+                codes = pd.Series(grouped_cut(df[var], age_codes, bins, include_lowest=True), index=df.index)
+                codes_percap = pd.Series(grouped_cut(df['percap_'+var], age_codes, bins_percap), index=df.index)
+                for age_cat in range(len(age_labels)):
+                    cats[var+'_cat{0}{1}'.format(num,age_cat)] = codes.where(age_codes==age_cat)
+                    cats['percap_'+var+'_cat{0}{1}'.format(num,age_cat)] = codes_percap.where(age_codes==age_cat)
+        #age-specific columns only cover their own age bracket and are NaN elsewhere.
+        return pd.DataFrame(cats, index=df.index)
+
+    """
+    Cancelled quantities. The text describes these as "per borrower." In the following,
+    we therefore cancel up to the amount "cancel" of the spouses loans, and up to
+    the amount "cancel" of the remainder of the household loans to obtain a measure
+    of cancellation for the household, and then adjust for per-capita.
+    """
+    @cached
+    @scf_profile.profiled('clean.cancellations')
+    def cancellations(self):
+        loans, cancels = self.loans, {}
+        for cancel in cancel_list:
+            cancels['self_cancel{0}'.format(cancel)] = np.minimum(cancel, loans['self_loans'] + loans['parent_loans'])
+            cancels['spouse_cancel{0}'.format(cancel)] = np.minimum(cancel, loans['spouse_loans'])
+            cancels['percap_cancel{0}'.format(cancel)] = (1 - (self.base['married']==1)/2)*(cancels['self_cancel{0}'.format(cancel)] + cancels['spouse_cancel{0}'.format(cancel)])
+        return pd.DataFrame(cancels)
+
+    """
+    All of the above as one frame. The cleaned frame is stored as Parquet in
+    cache_dir, under a key that changes with the source archives, the wave's
+    configuration and the code of the cleaning step ("sources"), so later runs
+    read it back instead of cleaning.
+    Once their columns are joined the groups are released (a group read again
+    afterwards is rebuilt), so a built dataset holds "data" alone.
+    """
+    @cached
+    @scf_profile.profiled('clean.data')
+    def data(self):
+        path = os.path.join(self.cache_dir, 'scf{0}-clean-{1}.parquet'.format(self.year, self.cache_key()))
+        if os.path.exists(path + '.json'):
+            return read_frame(path)
+        df = self.clean()
+        try:
+            write_frame(df, path)
+        except ImportError:
+            pass
+        return df
+
+    groups = ['base','loan_table','loans','percap','age','qctiles','cancellations']
+
+    def clean(self):
+        df = pd.concat([self.base, self.loans, self.percap, self.age, self.qctiles, self.cancellations], axis=1)
+        self.release()
+        return compact(df)
+
+    def release(self):
+        for group in self.groups:
+            self.__dict__.pop(group, None)
+
+    #the code of the cleaning step: this file, the modules it imports, and
+    #scf_weighted, whose grouping code it shares; a needless rebuild costs less
+    #than a stale frame.
+    sources = ['scf_data_clean.py', 'scf_kernels.py', 'scf_weighted.py', 'scf_profile.py']
+
+    def cache_key(self):
+        h = hashlib.sha256()
+        for name in self.sources:
+            h.update(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb').read())
+        for url in [wave(self.year)['summary'], wave(self.year)['full']]:
+            h.update(cached_archive(url, self.cache_dir, self.offline)[1].encode())
+        h.update(json.dumps(wave(self.year), sort_keys=True).encode())
+        return h.hexdigest()[:16]
+
+"""
+One Dataset per (year, cache_dir, offline), so repeated calls share the work.
+"scf_data_clean.data" is kept for the figure scripts and builds the default
+dataset the first time it is read.
+"""
+
+datasets = {}
+
+def build_dataset(year=2019, cache_dir=cache_dir, offline=offline):
+    key = (year, cache_dir, offline)
+    if key not in datasets:
+        datasets[key] = Dataset(year, cache_dir, offline)
+    return datasets[key]
+
+"""
+Several waves at once. Each wave is downloaded, parsed and cleaned on its own
+thread (the work is mostly waiting for the network and reading files), and the
+datasets are returned by year.
+"""
+
+def build_datasets(years, cache_dir=cache_dir, offline=offline, threads=None):
+    chosen = [build_dataset(year, cache_dir, offline) for year in years]
+    for year in years:
+        wave(year)
+    with ThreadPoolExecutor(max_workers=threads or len(chosen)) as pool:
+        list(pool.map(lambda ds: ds.data, chosen))
+    return dict(zip(years, chosen))
+
+def __getattr__(name):
+    if name == 'data':
+        return build_dataset().data
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
@@ -1,242 +1,178 @@
 """
 Main figures relevant for Commentary (excluding lifetime wealth calculations)
+
+Each function below computes the numbers behind one group of figures from the
+data; figure_specs turns them into figure specs that scf_render draws.
 """
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import time, datetime, pyreadstat, sys
-import scf_data_clean
+import time, datetime, sys
+import scf_data_clean, scf_weighted, scf_render, scf_cancellation, scf_profile
 """
-Obtain data, lists and functions from scf_data_clean.
+Obtain lists and functions from scf_data_clean.
 """
-data = scf_data_clean.data
 age_labels, values = scf_data_clean.age_labels, scf_data_clean.age_values
 slice_fun = scf_data_clean.slice_fun
 qctile_dict, cancel_list = scf_data_clean.qctile_dict, scf_data_clean.cancel_list
-c1, c2 = scf_data_clean.c1, scf_data_clean.c2
-colorFader = scf_data_clean.colorFader
 debt_list = scf_data_clean.debt_list
 debt_brackets = scf_data_clean.debt_brackets
 quantile = scf_data_clean.quantile
+spec = scf_render.spec
 
-"""
-Dummy for whether or not to show the figures
-"""
-
-show=0
+var_list_dict = {'income':'income','networth':'net worth','all_loans':'student debt'}
 
 """
-Income and networth percentiles.
+Income and networth percentiles for borrowers (first column) and all (second).
 """
 
-num, var_list_dict = 10, {'income':'income','networth':'net worth','all_loans':'student debt'}
-for var in ['income','networth']:
+@scf_profile.profiled('figures.percentiles')
+def percentiles(data, var, num=10):
     array_temp = np.zeros((num+1,2))
     df = data[data['percap_all_loans']>0]
-    array_temp[:,0] = np.array([scf_data_clean.quantile(df['percap_'+var], df['wgt'], j/num) for j in range(num+1)])
-    array_temp[:,1] = np.array([scf_data_clean.quantile(data['percap_'+var], data['wgt'], j/num) for j in range(num+1)])
-    width=2/5
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    for i in range(1,num,2): #only plot 10,30,50,70,90
-        if i==1:
-            ax.bar(i-width, array_temp[i,0]/10**3, 2*width, color=c1, label = "Borrowers")
-            ax.bar(i+width, array_temp[i,1]/10**3, 2*width, color=c2, label = "All")
-        else:
-            ax.bar(i-width, array_temp[i,0]/10**3, 2*width, color=c1)
-            ax.bar(i+width, array_temp[i,1]/10**3, 2*width, color=c2)
-    plt.xticks(range(1,num,2), (100/num)*np.arange(1,num,2))
-    #plt.figtext(0.1, 0, 'Source: 2019 SCF and authors\' calculations.', horizontalalignment='left')
-    ax.set_xlabel('Percentile')
-    ax.set_title('Per capita {0} percentiles'.format(var_list_dict[var]))
-    ax.set_ylabel('\$000s')
-    ax.legend()
-    destin = '../main/figures/BvsNB{0}.eps'.format(var)
-    plt.savefig(destin, format='eps', dpi=1000)
-    if show == 1:
-        plt.show()
-    plt.close()
+    array_temp[:,0] = scf_data_clean.qctiles(df['percap_'+var], df['wgt'], num)
+    array_temp[:,1] = scf_data_clean.qctiles(data['percap_'+var], data['wgt'], num)
+    return array_temp
 
 """
 Average student debt by per-capita income and net worth for borrowers and non-borrowers.
-"""
-
-"""
-Create dataframes giving the average per-capita student debt
-"""
-
-var_list = ['income','networth']
-var_list_dict = {'income':'income','networth':'net worth'}
-num, df_SD = 5, {}
-df_SD['borrowers'] = pd.DataFrame(columns=range(1,num+1), index=var_list)
-df_SD['all'] = pd.DataFrame(columns=range(1,num+1), index=var_list)
-for var2 in ['borrowers','all']:
-    for i in range(len(var_list)):
-        if var2 == 'borrowers':
-            df_temp = data[data['percap_all_loans']>0]
-        else:
-            df_temp = data
-        f = lambda x: np.average(x, weights=df_temp.loc[x.index, "wgt"])
-        gb = df_temp.groupby('percap_'+var_list[i]+'_cat{0}'.format(num))['percap_'+'all_loans'].agg(f).values
-        if len(gb) < num:
-            df_SD[var2].loc[var_list[i],num+1-len(gb):] = gb
-            df_SD[var2].loc[var_list[i],:num+1-len(gb)] = gb[0]
-        else:
-            df_SD[var2].loc[var_list[i],:] = gb
-    df_SD[var2] = (df_SD[var2]/1000).astype(float).round(1)
-
-"""
-Create the figures
-"""
-
-for var in var_list:
-    width = 1/5
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    for i in range(1,num+1):
-        if i==1:
-            ax.bar(i-width, df_SD['borrowers'].loc[var,i], 2*width, color=c1, label = "Borrowers")
-            ax.bar(i+width, df_SD['all'].loc[var,i], 2*width, color=c2, label = "All")
-        else:
-            ax.bar(i-width, df_SD['borrowers'].loc[var,i], 2*width, color=c1)
-            ax.bar(i+width, df_SD['all'].loc[var,i], 2*width, color=c2)
-    ax.set_xlabel('Per capita {0} {1}s'.format(var_list_dict[var],qctile_dict[num]))
-    ax.set_title('Average per-capita student debt')
-    ax.set_ylabel('\$000s')
-    ax.legend()
-    destin = '../main/figures/SD{0}{1}.eps'.format(qctile_dict[num],var)
-    plt.savefig(destin, format='eps', dpi=1000)
-    if show == 1:
-        plt.show()
-    plt.close()
+Returns dataframes giving the average per-capita student debt ($000s).
+"""
+
+@scf_profile.profiled('figures.SD_qctiles')
+def SD_qctiles(data, var_list=['income','networth'], num=5):
+    df_SD = {}
+    df_SD['borrowers'] = pd.DataFrame(columns=range(1,num+1), index=var_list)
+    df_SD['all'] = pd.DataFrame(columns=range(1,num+1), index=var_list)
+    for var2 in ['borrowers','all']:
+        for i in range(len(var_list)):
+            if var2 == 'borrowers':
+                df_temp = data[data['percap_all_loans']>0]
+            else:
+                df_temp = data
+            gb = scf_weighted.weighted_mean(df_temp, 'percap_'+var_list[i]+'_cat{0}'.format(num), 'percap_'+'all_loans').values
+            if len(gb) < num:
+                df_SD[var2].loc[var_list[i],num+1-len(gb):] = gb
+                df_SD[var2].loc[var_list[i],:num+1-len(gb)] = gb[0]
+            else:
+                df_SD[var2].loc[var_list[i],:] = gb
+        df_SD[var2] = (df_SD[var2]/1000).astype(float).round(1)
+    return df_SD
 
 """
 Print average income within quintiles (to justify statements made in the text
-that average per-capita income ratios).
-"""
-
-data_debt, num = data[data['percap_all_loans']>0], 5
-f = lambda x: np.average(x, weights=df_temp.loc[x.index, "wgt"])
-gb_debt_income = data_debt.groupby('percap_'+'income'+'_cat{0}'.format(num))['percap_'+'income'].agg(f).values
-gb_debt_debt = data_debt.groupby('percap_'+'income'+'_cat{0}'.format(num))['percap_'+'all_loans'].agg(f).values
-
-"""
-Ratios of income and student debt across quintiles
-"""
-
-print("Ratio of highest quintile to lowest (per-capita income):", gb_debt_income[4]/gb_debt_income[0])
-print("Ratio of highest quintile to lowest (per-capita student debt):", gb_debt_debt[4]/gb_debt_debt[0])
-
-"""
-Print average and median age for both borrowers and non-borrowers (mentioned in text)
+that average per-capita income ratios), and average and median age for both
+borrowers and non-borrowers (mentioned in text).
 """
 
-print("Average age of households:", np.average(data["age"], weights=data["wgt"]))
-print("Median age of households:", quantile(data["age"], weights=data["wgt"], quantile=0.5))
-print("Average age of households with debt:", np.average(data_debt["age"], weights=data_debt["wgt"]))
-print("Median age of households with debt:", quantile(data_debt["age"], weights=data_debt["wgt"], quantile=0.5))
+@scf_profile.profiled('figures.print_statistics')
+def print_statistics(data, num=5):
+    data_debt = data[data['percap_all_loans']>0]
+    gb = scf_weighted.weighted_mean(data_debt, 'percap_'+'income'+'_cat{0}'.format(num), ['percap_'+'income', 'percap_'+'all_loans'])
+    gb_debt_income, gb_debt_debt = gb['percap_'+'income'].values, gb['percap_'+'all_loans'].values
+    #Ratios of income and student debt across quintiles
+    print("Ratio of highest quintile to lowest (per-capita income):", gb_debt_income[4]/gb_debt_income[0])
+    print("Ratio of highest quintile to lowest (per-capita student debt):", gb_debt_debt[4]/gb_debt_debt[0])
+    print("Average age of households:", np.average(data["age"], weights=data["wgt"]))
+    print("Median age of households:", quantile(data["age"], weights=data["wgt"], quantile=0.5))
+    print("Average age of households with debt:", np.average(data_debt["age"], weights=data_debt["wgt"]))
+    print("Median age of households with debt:", quantile(data_debt["age"], weights=data_debt["wgt"], quantile=0.5))
 
 """
-Mean and median per-capita income and networth by age group.
+Mean and median per-capita income and networth by age group ($000s).
 """
 
-df = data
-var_list = ['income','networth']
-var_list_dict = {'income':'income','networth':'net worth'}
-for var in var_list:
+@scf_profile.profiled('figures.mm_age')
+def mm_age(data, var):
     array_temp = np.zeros((len(age_labels),2))
-    gb = df.groupby(df['age_cat'])
-    array_temp[:,0] = gb['percap_'+var].agg(lambda x: np.average(x,weights=df.loc[x.index,"wgt"]))/10**3
-    array_temp[:,1] = gb['percap_'+var].agg(lambda x: scf_data_clean.quantile(x,df.loc[x.index,"wgt"],0.5))/10**3
-    width = 1/5
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    for j in range(len(age_labels)):
-        if j==0:
-            ax.bar(j+1-width, array_temp[j,0], 2*width, color=c1, label = "Mean")
-            ax.bar(j+1+width, array_temp[j,1], 2*width, color=c2, label = "Median")
-        else:
-            ax.bar(j+1-width, array_temp[j,0], 2*width, color=c1)
-            ax.bar(j+1+width, array_temp[j,1], 2*width, color=c2)
-    plt.xticks(range(1,len(age_labels)+1),age_labels)
-    ax.set_xlabel('Age groups')
-    ax.set_title('Mean and median per-capita {0}'.format(var_list_dict[var]))
-    ax.set_ylabel('\$000s')
-    ax.legend(loc='upper left')
-    destin = '../main/figures/{0}mmAGE.eps'.format(var)
-    plt.savefig(destin, format='eps', dpi=1000)
-    if show == 1:
-        plt.show()
-    plt.close()
+    array_temp[:,0] = scf_weighted.weighted_mean(data, 'age_cat', 'percap_'+var)/10**3
+    array_temp[:,1] = scf_weighted.weighted_median(data, 'age_cat', 'percap_'+var)/10**3
+    return array_temp
 
 """
 Average debt by quintiles of income, and fraction of households in each bin.
 """
 
-num, df_SD_quintiles = 5, {}
-var_list = ['income']
-var_list_dict = {'income':'income','networth':'net worth'}
-df_SD_quintiles = pd.DataFrame(columns=range(1,num+1), index=var_list)
-for i in range(len(var_list)):
-    f = lambda x: np.average(x, weights=data.loc[x.index, "wgt"])
-    gb = data.groupby('percap_'+var_list[i]+'_cat{0}'.format(num))['percap_'+'all_loans'].agg(f).values
-    df_SD_quintiles.loc[var_list[i],:] = gb
-
-"""
-Now create the figures for the fraction of households within each bin.
-"""
-
-for var in var_list:
-    quintiles = np.array([scf_data_clean.quantile(data['percap_{0}'.format(var)],data['wgt'], j/5) for j in range(6)])
+@scf_profile.profiled('figures.SD_quintiles')
+def SD_quintiles(data, var_list=['income'], num=5):
+    df_SD_quintiles = pd.DataFrame(columns=range(1,num+1), index=var_list)
+    for i in range(len(var_list)):
+        gb = scf_weighted.weighted_mean(data, 'percap_'+var_list[i]+'_cat{0}'.format(num), 'percap_'+'all_loans').values
+        df_SD_quintiles.loc[var_list[i],:] = gb
+    return df_SD_quintiles
+
+#total weight of households in each (quintile of var, debt bracket) pair.
+@scf_profile.profiled('figures.debt_count')
+def debt_count(data, var, num=5):
+    quintiles = scf_data_clean.qctiles(data['percap_{0}'.format(var)],data['wgt'], num)
     qct_lists, var_names = [quintiles,debt_list],['percap_{0}'.format(var),'percap_all_loans']
     d = [pd.cut(data[var_names[i]], bins=qct_lists[i],labels=range(len(qct_lists[i])-1),include_lowest=True,duplicates='drop') for i in range(2)]
-    data['pairs'] = list(zip(d[0], d[1]))
-    SD_debt = data.groupby(data['pairs'])['percap_all_loans']
-    SD_debt_count = data.groupby(data['pairs'])['wgt'].sum()
-    width = 1/5
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    for i in range(len(quintiles)-1):
-        #for each quintile normalize so that sum is 1
-        norm = sum([SD_debt_count[(i,j)] for j in range(len(debt_list)-1)])
-        for j in range(len(debt_list)-1):
-            if i==0:
-                ax.bar(i+1-((len(debt_list)-2)/2-j)*width,SD_debt_count[(i,j)]/norm,width,color=colorFader(c1,c2,j/(len(debt_list)-2)),label=debt_brackets[j])
-            else:
-                ax.bar(i+1-((len(debt_list)-2)/2-j)*width,SD_debt_count[(i,j)]/norm,width,color=colorFader(c1,c2,j/(len(debt_list)-2)))
-    ax.set_xlabel('Per capita {0} quintile'.format('income'))
-    ax.set_title('Fraction of population')
-    ax.legend()
-    ax.set_ylim([0, 1])
-    destin = '../main/figures/percap_{0}_debt_count.eps'.format(var)
-    plt.savefig(destin, format='eps', dpi=1000)
-    if show == 1:
-        plt.show()
-    plt.close()
-
-"""
-Cancellation values broken down by income and networth distributions.
-"""
-
-df = data
-f = lambda x: np.average(x, weights=data.loc[x.index, "wgt"])
-num = 5
-for var in ["income", "networth"]:
-    array_temp = np.zeros((num,len(cancel_list)))
-    gb = df.groupby(df['percap_'+var+'_cat{0}'.format(num)])
-    for i, cancel in enumerate(cancel_list):
-        array_temp[:,i] = gb['percap_cancel{0}'.format(cancel)].agg(f)
-        width = 2/5
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        for j in range(num):
-            ax.bar(j+1, array_temp[j,i], 2*width, color=c2)
-        plt.xticks(np.arange(1, num+1))
-        ax.set_xlabel('Per capita {0} {1}s'.format(var_list_dict[var],qctile_dict[num]))
-        ax.set_title('Up to \${0},000 forgiven'.format(int(cancel/10**3)))
-        ax.set_ylabel('\$')
-        destin = '../main/figures/cancel{0}{1}{2}.eps'.format(var,qctile_dict[num],cancel)
-        plt.savefig(destin, format='eps', dpi=1000)
-        if show == 1:
-            plt.show()
-    plt.close()
+    return scf_weighted.weighted_crosstab(d[0], d[1], data['wgt'], (len(quintiles)-1, len(debt_list)-1))
+
+"""
+Cancellation values broken down by income and networth distributions: one
+column for each amount in cancel_list.
+"""
+
+@scf_profile.profiled('figures.cancellation')
+def cancellation(data, var, num=5, cancel_list=cancel_list):
+    return scf_cancellation.simulate_cancellation(data, cancel_list, by='percap_'+var+'_cat{0}'.format(num)).values.T
+
+"""
+The figures
+"""
+
+def figure_specs(data, cancel_list=cancel_list):
+    specs = []
+    num = 10
+    for var in ['income','networth']:
+        array_temp = percentiles(data, var, num)
+        x = list(range(1,num,2)) #only plot 10,30,50,70,90
+        specs.append(spec('BvsNB{0}'.format(var), 'pair', array_temp[x]/10**3, x=x, width=2/5,
+            xticks=(x, list((100/num)*np.arange(1,num,2))), xlabel='Percentile',
+            title='Per capita {0} percentiles'.format(var_list_dict[var]), ylabel='\\$000s', legend={}))
+    num, var_list = 5, ['income','networth']
+    df_SD = SD_qctiles(data, var_list, num)
+    for var in var_list:
+        table = np.column_stack([df_SD['borrowers'].loc[var].values, df_SD['all'].loc[var].values])
+        specs.append(spec('SD{0}{1}'.format(qctile_dict[num],var), 'pair', table, x=list(range(1,num+1)),
+            xlabel='Per capita {0} {1}s'.format(var_list_dict[var],qctile_dict[num]),
+            title='Average per-capita student debt', ylabel='\\$000s', legend={}))
+    for var in ['income','networth']:
+        specs.append(spec('{0}mmAGE'.format(var), 'pair', mm_age(data, var), x=list(range(1,len(age_labels)+1)),
+            labels=("Mean","Median"), xticks=(list(range(1,len(age_labels)+1)),age_labels), xlabel='Age groups',
+            title='Mean and median per-capita {0}'.format(var_list_dict[var]), ylabel='\\$000s', legend={'loc':'upper left'}))
+    for var in ['income']:
+        specs.append(spec('percap_{0}_debt_count'.format(var), 'shares', debt_count(data, var),
+            xlabel='Per capita {0} quintile'.format('income'), title='Fraction of population', legend={}, ylim=[0, 1]))
+    for var in ["income", "networth"]:
+        array_temp = cancellation(data, var, num, cancel_list)
+        for i, cancel in enumerate(cancel_list):
+            specs.append(spec('cancel{0}{1}{2}'.format(var,qctile_dict[num],cancel), 'single', array_temp[:,i],
+                x=list(range(1,num+1)), xticks=(list(np.arange(1, num+1)),),
+                xlabel='Per capita {0} {1}s'.format(var_list_dict[var],qctile_dict[num]),
+                title='Up to \\${0},000 forgiven'.format(int(cancel/10**3)), ylabel='\\$'))
+    return specs
+
+"""
+Print the statistics quoted in the text and, unless figures=False, draw the
+figures in format fmt on "jobs" processes (only those that changed, unless
+force=True). Returns the figure specs.
+
+With years=[...] this is done for every wave, and the figures of all waves are
+drawn in one pass; figures of waves other than 2019 get _year appended to
+their name. data, if given, is taken to be the 2019 wave.
+"""
+
+def main(data=None, figures=True, fmt='eps', jobs=1, force=False, years=None, cancel_list=cancel_list,
+         fig_dir=scf_render.fig_dir, cache_dir=scf_data_clean.cache_dir):
+    specs = []
+    for year, df in scf_render.frames(data, years, cache_dir).items():
+        print("Statistics for the {0} wave".format(year))
+        print_statistics(df)
+        specs += scf_render.with_year(figure_specs(df, cancel_list), year)
+    if figures:
+        scf_render.render(specs, fmt, jobs, fig_dir, force=force)
+    return specs
+
+if __name__ == '__main__':
+    main()
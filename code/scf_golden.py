@@ -0,0 +1,87 @@
+"""
+Numeric tables behind the figures, and checks against stored ("golden") tables.
+
+The figures themselves cannot be compared numerically, so write_tables saves the
+table of every figure spec (df_SD, SD_debt_count, the cancellation arrays, ...)
+to a canonical JSON file: one entry per figure name, keys sorted, floats written
+in full, NaN as null. compare_tables lists the figures whose tables differ from
+another such file beyond a tolerance.
+
+Run as a script this computes every table on a small synthetic fixture (see
+scf_synthetic), so it needs no download, and compares them with the golden
+tables in main/golden:
+
+    python scf_golden.py                  #check, exit status 1 on a difference
+    python scf_golden.py --jobs 4         #check the parallel engines
+    python scf_golden.py --update         #store the current tables as golden
+
+--tables and --golden compare any two table files instead, e.g. those written
+by main.py --tables for the real data before and after a change.
+"""
+import os, json, argparse, sys
+import numpy as np
+
+golden_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main', 'golden')
+fixture = {'rows': 2000, 'seed': 0}
+
+def tables(specs):
+    return {s['name']: np.asarray(s['table'], dtype=float) for s in specs}
+
+def write_tables(specs, path):
+    out = {name: np.where(np.isnan(table), None, table).tolist() for name, table in tables(specs).items()}
+    with open(path, 'w') as f:
+        json.dump(out, f, indent=1, sort_keys=True)
+
+def read_tables(path):
+    with open(path) as f:
+        return {name: np.array(table, dtype=float) for name, table in json.load(f).items()}
+
+"""
+Differences between two {name: table} dicts: a list of (name, reason), empty if
+every table has the same shape and agrees within rtol/atol (NaNs must match).
+"""
+
+def compare_tables(current, golden, rtol=1e-9, atol=1e-9):
+    diffs = [(name, 'missing') for name in sorted(set(golden) - set(current))]
+    diffs += [(name, 'not in golden tables') for name in sorted(set(current) - set(golden))]
+    for name in sorted(set(current) & set(golden)):
+        a, b = current[name], golden[name]
+        if a.shape != b.shape:
+            diffs.append((name, 'shape {0} != {1}'.format(a.shape, b.shape)))
+        elif not np.allclose(a, b, rtol=rtol, atol=atol, equal_nan=True):
+            worst = np.nanmax(np.abs(a - b))
+            diffs.append((name, 'largest difference {0:g}'.format(worst)))
+    return diffs
+
+"""
+Specs of every figure, computed on data without drawing anything.
+"""
+
+def all_specs(data, jobs=1):
+    import scf_figures, scf_lifetime_wealth
+    return scf_figures.main(data, figures=False, jobs=jobs) + scf_lifetime_wealth.main(data, jobs=jobs, figures=False)
+
+def fixture_specs(jobs=1):
+    import scf_synthetic
+    return all_specs(scf_synthetic.SyntheticDataset(**fixture).data, jobs)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the figure tables with golden tables.')
+    parser.add_argument('--update', action='store_true', help='store the fixture tables as golden')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--tables', help='table file to check (default: compute on the fixture)')
+    parser.add_argument('--golden', default=os.path.join(golden_dir, 'fixture.json'), help='golden table file')
+    parser.add_argument('--rtol', type=float, default=1e-9)
+    parser.add_argument('--atol', type=float, default=1e-9)
+    args = parser.parse_args()
+    if args.update:
+        os.makedirs(os.path.dirname(args.golden), exist_ok=True)
+        write_tables(fixture_specs(args.jobs), args.golden)
+        print("Wrote", args.golden)
+        sys.exit(0)
+    current = read_tables(args.tables) if args.tables else tables(fixture_specs(args.jobs))
+    diffs = compare_tables(current, read_tables(args.golden), args.rtol, args.atol)
+    for name, reason in diffs:
+        print("DIFF", name, reason)
+    print("{0} of {1} tables differ".format(len(diffs), len(current)))
+    sys.exit(1 if diffs else 0)
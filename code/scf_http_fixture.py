@@ -0,0 +1,111 @@
+"""
+Local stand-in for the Federal Reserve file server, to test downloading offline.
+
+write_archives writes a wave's summary and full public files as zipped .dta
+files holding synthetic data (see scf_synthetic), and server serves a folder over
+HTTP with Range and If-Range support, as the Fed server does. drop_after cuts every response
+after that many bytes, to check that an interrupted download resumes (it must be
+larger than the chunks of scf_data_clean.download, 64 KB, to make progress):
+
+    python scf_http_fixture.py --rows 50000 --port 8060 --drop-after 500000
+    SCF_BASE_URL=http://127.0.0.1:8060/ python main.py --cache-dir /tmp/scf-cache
+
+(the first run stops at a broken download, the next ones pick it up from the
+.part file until the archives are complete.)
+"""
+import os, re, argparse, tempfile, zipfile
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import scf_data_clean, scf_synthetic
+
+"""
+Summary and full files of a synthetic wave, with the summary file in 2022
+dollars as published: the wave's factor, or asset_adj for a wave without one
+(1 if neither is set). The summary file's edn_inst is the total of the loan
+balances, converted likewise.
+"""
+
+def write_archives(directory, year=2019, rows=2000, seed=0, asset_adj=None):
+    os.makedirs(directory, exist_ok=True)
+    factor = scf_data_clean.wave(year)['asset_adj'] or asset_adj or 1.0
+    df = scf_synthetic.synthetic_base(rows, seed).reset_index()
+    for var in ['income','networth','asset','wageinc']:
+        df[var] = df[var]*factor
+    df['edn_inst'] = df[scf_data_clean.bal_list].clip(lower=0).sum(axis=1)*factor
+    #the synthetic frame has the 2019 loan columns: rename them to this wave's.
+    df = df.rename(columns=dict(zip(scf_data_clean.whom_list + scf_data_clean.bal_list,
+                                    scf_data_clean.wave(year)['whom'] + scf_data_clean.wave(year)['bal'])))
+    full = scf_data_clean.full_columns(year)
+    summary = ['yy1','y1'] + [c for c in df.columns if c not in full]
+    paths = []
+    for url, cols in [(scf_data_clean.wave(year)['summary'], summary), (scf_data_clean.wave(year)['full'], full)]:
+        name = url.rsplit('/', 1)[-1]
+        with tempfile.TemporaryDirectory() as tmp:
+            dta = os.path.join(tmp, name.replace('.zip', '.dta'))
+            df[cols].to_stata(dta, write_index=False)
+            paths.append(os.path.join(directory, name))
+            with zipfile.ZipFile(paths[-1], 'w', zipfile.ZIP_DEFLATED) as z:
+                z.write(dta, os.path.basename(dta))
+    return paths
+
+"""
+Request handler serving "directory", honouring "Range: bytes=start-" (the only
+form download sends) and stopping each response after drop_after bytes. The ETag
+changes with the file, and a Range whose If-Range is not the current ETag or
+Last-Modified date is ignored, so the whole file is sent again.
+"""
+
+def handler(directory, drop_after=None):
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directory, **kwargs)
+
+        def do_GET(self):
+            path = self.translate_path(self.path)
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            stat = os.stat(path)
+            size, etag = stat.st_size, '"{0:x}-{1:x}"'.format(stat.st_size, stat.st_mtime_ns)
+            modified = self.date_time_string(int(stat.st_mtime))
+            match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+            if self.headers.get('If-Range', etag) not in (etag, modified):
+                match = None
+            start = int(match.group(1)) if match else 0
+            if start >= size > 0:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206 if match else 200)
+            self.send_header('Content-Type', 'application/zip')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', modified)
+            self.send_header('Content-Length', str(size - start))
+            if match:
+                self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, size-1, size))
+            self.end_headers()
+            with open(path, 'rb') as f:
+                f.seek(start)
+                self.wfile.write(f.read(drop_after))
+
+    return Handler
+
+def server(directory, host='127.0.0.1', port=0, drop_after=None):
+    return ThreadingHTTPServer((host, port), handler(directory, drop_after))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve synthetic SCF archives over HTTP.')
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), 'scf-fixture'), help='folder to write and serve')
+    parser.add_argument('--years', type=int, nargs='+', default=[2019])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8060)
+    parser.add_argument('--drop-after', type=int, help='cut every response after this many bytes')
+    args = parser.parse_args()
+    for year in args.years:
+        write_archives(args.dir, year, args.rows, args.seed)
+    httpd = server(args.dir, args.host, args.port, args.drop_after)
+    print("Serving {0} on http://{1}:{2}/".format(args.dir, args.host, httpd.server_port))
+    httpd.serve_forever()
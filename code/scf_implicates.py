@@ -0,0 +1,186 @@
+"""
+Estimates that account for the five implicates of the SCF and standard errors
+from the SCF replicate weights.
+
+Each household appears five times in the public data (y1 = 10*yy1 + implicate).
+Every statistic is computed separately for each implicate in one grouped pass,
+with the implicate as an extra grouping key, and the five estimates are
+combined with Rubin's rules: the point estimate is their average and the total
+variance is W + (1 + 1/m)B, where B is the variance between implicates and W the
+average sampling variance within implicates.
+
+W comes from the bootstrap replicate weights (scf2019rw1s.zip: weight wt1b{r}
+times multiplicity mm{r} for replicate r = 1,...,999). Rather than re-running the
+pipeline per replicate, the main weight and all replicate weights form one
+(households x 1+R) weight matrix, and weighted group means for every
+(implicate, group, replicate) are one product of a (groups x households)
+indicator matrix with that matrix. The sampling variance of each implicate's
+estimate is the mean squared deviation of its replicate estimates from the
+full-sample estimate. Group membership (e.g. quintiles) is held fixed across
+replicates.
+"""
+import numpy as np
+import pandas as pd
+import scf_data_clean, scf_weighted
+
+rw_url = 'https://www.federalreserve.gov/econres/files/scf2019rw1s.zip'
+num_replicates = 999
+
+#implicate of each row, numbered 0,...,4.
+def implicate_codes(df):
+    y1 = np.asarray(df.index.get_level_values('y1'))
+    yy1 = np.asarray(df.index.get_level_values('yy1'))
+    return (y1 - 10*yy1 - 1).astype(np.int64)
+
+"""
+Replicate weights for the rows of df, as a (rows x R) array.
+"""
+
+def replicate_weights(df, R=num_replicates, url=rw_url, cache_dir=scf_data_clean.cache_dir, offline=scf_data_clean.offline):
+    columns = ['y1'] + ['wt1b{0}'.format(r+1) for r in range(R)] + ['mm{0}'.format(r+1) for r in range(R)]
+    rw = scf_data_clean.data_from_url(url, columns=columns, cache_dir=cache_dir, offline=offline).set_index('y1')
+    rw = rw.reindex(df.index.get_level_values('y1'))
+    wt = rw[['wt1b{0}'.format(r+1) for r in range(R)]].values
+    mm = rw[['mm{0}'.format(r+1) for r in range(R)]].values
+    return np.nan_to_num(wt*mm)
+
+#main weight followed by the replicate weights (if any).
+def weight_matrix(df, replicates=None, weight='wgt'):
+    w = np.asarray(df[weight], dtype=float)[:,None]
+    return w if replicates is None else np.hstack([w, replicates])
+
+"""
+Weighted means of "values" by "by" for each implicate and weight column.
+Returns an array (values x implicates x groups x weight columns) and the
+index of the groups. Weight columns are processed "chunk" at a time to bound
+memory.
+"""
+
+def implicate_means(df, by, values, W, m=5, chunk=100):
+    values = [values] if isinstance(values, str) else list(values)
+    codes, index = scf_weighted.group_index(df, by)
+    G, imp = len(index), implicate_codes(df)
+    keep = (codes >= 0) & (imp >= 0) & (imp < m)
+    rows = np.flatnonzero(keep)
+    indicator = np.zeros((m*G, len(df)))
+    indicator[imp[rows]*G + codes[rows], rows] = 1
+    out = np.empty((len(values), m*G, W.shape[1]))
+    x = [np.asarray(df[var], dtype=float) for var in values]
+    for start in range(0, W.shape[1], chunk):
+        Wc = W[:, start:start+chunk]
+        totals = indicator @ Wc
+        for v in range(len(values)):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[v, :, start:start+chunk] = (indicator @ (x[v][:,None]*Wc))/totals
+    return out.reshape(len(values), m, G, W.shape[1]), index
+
+"""
+Weighted quantiles by group for every column of a weight matrix W, equal to
+scf_data_clean.grouped_quantile called column by column. Weights do not affect
+the sort by (group, value), so it is done once; each chunk of columns is then
+one cumsum down the sorted weights, and each column one searchsorted of the
+(group, quantile) targets in its CDF. Returns (groups x quantiles x columns).
+"""
+
+def grouped_quantiles(data, W, groups, quantile, ngroups, chunk=100):
+    data, groups = np.asarray(data, dtype=float), np.asarray(groups)
+    q = np.atleast_1d(np.asarray(quantile, dtype=float))
+    rows = np.flatnonzero(groups >= 0)
+    order = rows[np.lexsort((data[rows], groups[rows]))]
+    x, g, n = data[order], groups[order].astype(np.int64), len(order)
+    start = np.searchsorted(g, np.arange(ngroups), side='left')
+    end = np.searchsorted(g, np.arange(ngroups), side='right')
+    tg, tq = np.repeat(np.arange(ngroups), len(q)), np.tile(q, ngroups)
+    s, e = start[tg][:,None], end[tg][:,None]
+    out = np.full((len(tg), W.shape[1]), np.nan)
+    if n == 0:
+        return out.reshape(ngroups, len(q), W.shape[1])
+    for c in range(0, W.shape[1], chunk):
+        #rows of the data in sorted order, one column per weight column.
+        Sn = np.cumsum(np.asarray(W[order, c:c+chunk], dtype=float), axis=0)
+        Sn0 = np.vstack((np.zeros((1, Sn.shape[1])), Sn))
+        offset = Sn0[start]
+        total = Sn0[end] - offset
+        with np.errstate(invalid='ignore', divide='ignore'):
+            Pn = (Sn - offset[g])/total[g]
+        #a group without weight has no CDF: its points lie above every quantile,
+        #as NaNs do in grouped_quantile's merge.
+        Pn[np.isnan(Pn)] = 2
+        #Pn is in [0, 1] (or 2), so 3*group + Pn increases down each column. It is
+        #rounded, so hi is then moved to the first point of its group with Pn > q.
+        keys, targets = 3*g[:,None] + Pn, 3*tg + tq
+        hi = np.column_stack([np.searchsorted(keys[:,k], targets, side='right') for k in range(Pn.shape[1])])
+        col = np.arange(Pn.shape[1])[None,:]
+        while True:
+            down = (hi > s) & (Pn[np.maximum(hi-1, 0), col] > tq[:,None])
+            up = (hi < e) & (Pn[np.minimum(hi, n-1), col] <= tq[:,None])
+            if not (down.any() or up.any()):
+                break
+            hi = hi - down + up
+        lo = hi - 1
+        #np.interp: below the first point return its value, at or above the last return the last.
+        part = np.full(hi.shape, np.nan)
+        first, last = (hi <= s) & (e > s), (hi >= e) & (e > s)
+        mid = ~(hi <= s) & ~last & (e > s)
+        part[first] = x[np.broadcast_to(s, hi.shape)[first]]
+        part[last] = x[np.broadcast_to(e, hi.shape)[last] - 1]
+        cols = np.broadcast_to(col, hi.shape)[mid]
+        slope = (x[hi[mid]] - x[lo[mid]])/(Pn[hi[mid], cols] - Pn[lo[mid], cols])
+        part[mid] = slope*(np.broadcast_to(tq[:,None], hi.shape)[mid] - Pn[lo[mid], cols]) + x[lo[mid]]
+        out[:, c:c+chunk] = part
+    return out.reshape(ngroups, len(q), W.shape[1])
+
+"""
+Weighted quantiles by "by" for each implicate (and weight column), from one
+sort (see grouped_quantiles). Returns (implicates x groups x quantiles x weight
+columns) and the group index.
+"""
+
+def implicate_quantiles(df, by, var, quantile, W, m=5):
+    codes, index = scf_weighted.group_index(df, by)
+    G, imp = len(index), implicate_codes(df)
+    key = np.where((codes >= 0) & (imp >= 0) & (imp < m), imp*G + codes, -1)
+    q = np.atleast_1d(quantile)
+    out = grouped_quantiles(df[var], W, key, q, m*G)
+    return out.reshape(m, G, len(q), W.shape[1]), index
+
+"""
+Rubin's rules. estimates has implicates on axis "axis" and the weight columns
+(full sample first, then replicates) last. Returns point estimates and
+standard errors. Without replicates only the between-implicate variance is used.
+"""
+
+def rubin(estimates, axis):
+    estimates = np.moveaxis(estimates, axis, -2)
+    m = estimates.shape[-2]
+    Q = estimates[...,0]
+    B = Q.var(axis=-1, ddof=1)
+    if estimates.shape[-1] > 1:
+        W = ((estimates[...,1:] - estimates[...,:1])**2).mean(axis=-1).mean(axis=-1)
+    else:
+        W = 0
+    return Q.mean(axis=-1), np.sqrt(W + (1 + 1/m)*B)
+
+"""
+Point estimates and standard errors of weighted means by group, e.g. average
+per-capita student debt by income quintile, as a frame with a (value, 'mean'/'se')
+column for each value. Pass replicates=replicate_weights(df) for bootstrap errors.
+"""
+
+def estimate_means(df, by, values, replicates=None, m=5):
+    values = [values] if isinstance(values, str) else list(values)
+    means, index = implicate_means(df, by, values, weight_matrix(df, replicates), m)
+    point, se = rubin(means, axis=1)
+    columns = {}
+    for v, var in enumerate(values):
+        columns[(var, 'mean')], columns[(var, 'se')] = point[v], se[v]
+    return pd.DataFrame(columns, index=index)
+
+def estimate_quantiles(df, by, var, quantile, replicates=None, m=5):
+    q = np.atleast_1d(quantile)
+    qs, index = implicate_quantiles(df, by, var, q, weight_matrix(df, replicates), m)
+    point, se = rubin(qs, axis=0)
+    columns = {}
+    for k in range(len(q)):
+        columns[(q[k], 'estimate')], columns[(q[k], 'se')] = point[:,k], se[:,k]
+    return pd.DataFrame(columns, index=index)
@@ -0,0 +1,166 @@
+"""
+Numeric kernels behind the heaviest loops, with interchangeable backends:
+
+    weighted_quantile    sort, weighted CDF and interpolation (scf_data_clean.quantile)
+    group_sums           total weight and weighted sums of several columns by
+                         group code (scf_weighted.weighted_sum/weighted_mean)
+    income_multipliers   discounted sum of income growth paths over the horizon
+                         (scf_lifetime_wealth.lifetime_wealth and _grid)
+    shocked_multipliers  the same with a shock per year and draw (scf_monte_carlo)
+
+"numpy" is the reference implementation. "numba" compiles loops that make one
+pass over the data without the temporaries of the NumPy version (e.g. no
+households x draws x years array of paths), except for weighted_quantile which
+it takes from "numpy". It gives the same results up to rounding, and is used
+when Numba can be imported unless SCF_KERNELS=numpy (use('numpy') also selects
+it at run time). The backend is chosen on the first kernel call, and Numba (slow
+to import) is only imported then, if it is chosen, so importing this module
+costs nothing. Compiled kernels are cached on disk (by Numba, in __pycache__ or
+NUMBA_CACHE_DIR), so compilation is paid once per machine and not on every start.
+scf_benchmark.py --kernels compares the backends.
+"""
+import os, threading
+import numpy as np
+
+requested = os.environ.get('SCF_KERNELS', 'auto')
+
+"""
+NumPy kernels.
+"""
+
+def np_weighted_quantile(data, weights, q):
+    #a stable sort keeps tied values in their original order (see scf_data_clean.quantile).
+    ind_sorted = np.argsort(data, kind='stable')
+    Sn = np.cumsum(weights[ind_sorted])
+    return np.interp(q, Sn/Sn[-1], data[ind_sorted])
+
+def np_group_sums(codes, weights, values, ngroups):
+    keep = codes >= 0
+    total = np.bincount(codes[keep], weights=weights[keep], minlength=ngroups)
+    sums = np.empty((ngroups, values.shape[1]))
+    for k in range(values.shape[1]):
+        sums[:,k] = np.bincount(codes[keep], weights=(weights*values[:,k])[keep], minlength=ngroups)
+    return total, sums
+
+#gr, alive: (rows x years-1) growth rates and alive flags; discount: (years x rates).
+def np_income_multipliers(gr, alive, discount):
+    paths = np.ones((len(gr), gr.shape[1]+1))
+    paths[:,1:] = np.cumprod(alive*np.exp(gr), axis=1)
+    #NaNs (due to overflow of age) are ignored in the sum, as in pandas.
+    return np.nan_to_num(paths) @ discount
+
+#shocks: (rows x draws x years-1); discount: (years,). Returns (rows x draws).
+def np_shocked_multipliers(gr, alive, shocks, sigma, discount):
+    paths = np.cumprod(alive[:,None,:]*np.exp(gr[:,None,:] + sigma*shocks), axis=2)
+    return discount[0] + np.nan_to_num(paths) @ discount[1:]
+
+backends = {'numpy': {'weighted_quantile': np_weighted_quantile, 'group_sums': np_group_sums,
+                      'income_multipliers': np_income_multipliers, 'shocked_multipliers': np_shocked_multipliers}}
+
+"""
+Numba kernels, compiled by numba_backend when the backend is first used. A path
+that reaches NaN (an age without a growth rate) stays NaN and, as nan_to_num
+above, adds nothing from then on.
+"""
+
+def nb_group_sums(codes, weights, values, ngroups):
+    total, sums = np.zeros(ngroups), np.zeros((ngroups, values.shape[1]))
+    for i in range(len(codes)):
+        c = codes[i]
+        if c >= 0:
+            total[c] += weights[i]
+            for k in range(values.shape[1]):
+                sums[c, k] += weights[i]*values[i, k]
+    return total, sums
+
+def nb_income_multipliers(gr, alive, discount):
+    out = np.empty((gr.shape[0], discount.shape[1]))
+    for i in range(gr.shape[0]):
+        for r in range(discount.shape[1]):
+            out[i, r] = discount[0, r]
+        path = 1.0
+        for t in range(gr.shape[1]):
+            path *= alive[i, t]*np.exp(gr[i, t])
+            if np.isnan(path):
+                break
+            for r in range(discount.shape[1]):
+                out[i, r] += path*discount[t+1, r]
+    return out
+
+def nb_shocked_multipliers(gr, alive, shocks, sigma, discount):
+    out = np.empty((shocks.shape[0], shocks.shape[1]))
+    for i in range(shocks.shape[0]):
+        for d in range(shocks.shape[1]):
+            total, path = discount[0], 1.0
+            for t in range(gr.shape[1]):
+                path *= alive[i, t]*np.exp(gr[i, t] + sigma*shocks[i, d, t])
+                if np.isnan(path):
+                    break
+                total += path*discount[t+1]
+            out[i, d] = total
+    return out
+
+#the quantile's cost is the sort, and Numba's argsort is no faster than NumPy's
+#(scf_benchmark.py --kernels), so the NumPy kernel is kept.
+def numba_backend():
+    import numba
+    jit = numba.njit(cache=True)
+    return {'weighted_quantile': np_weighted_quantile, 'group_sums': jit(nb_group_sums),
+            'income_multipliers': jit(nb_income_multipliers), 'shocked_multipliers': jit(nb_shocked_multipliers)}
+
+"""
+Backend selection, and the kernels as called by the rest of the code: inputs
+are converted here to the contiguous float (or int64 code) arrays both backends
+expect. Backends in "loaders" are built on first request (load), under a lock
+since the first kernel calls may come from several threads (build_datasets).
+available lists the backends that can be used, loading them all.
+"""
+
+loaders = {'numba': numba_backend}
+load_lock = threading.Lock()
+backend = None
+
+def load(name):
+    with load_lock:
+        if name in loaders:
+            try:
+                backends[name] = loaders.pop(name)()
+            except ImportError: #optional: the NumPy kernels are used instead
+                pass
+        return name in backends
+
+def available():
+    return [name for name in sorted(set(backends) | set(loaders)) if load(name)]
+
+def use(name='auto'):
+    global backend
+    if name == 'auto':
+        name = 'numba' if load('numba') else 'numpy'
+    if not load(name):
+        raise ValueError("kernel backend {0!r} is not available (have {1})".format(name, available()))
+    backend = name
+
+def kernel(name):
+    if backend is None:
+        use(requested)
+    return backends[backend][name]
+
+def weighted_quantile(data, weights, q):
+    q = np.asarray(q, dtype=float)
+    out = kernel('weighted_quantile')(np.ascontiguousarray(data, dtype=float),
+                                      np.ascontiguousarray(weights, dtype=float), np.atleast_1d(q))
+    return out.reshape(q.shape)[()] #a number for a scalar q, as np.interp
+
+def group_sums(codes, weights, values, ngroups):
+    values = np.ascontiguousarray(values, dtype=float).reshape(len(codes), -1)
+    return kernel('group_sums')(np.ascontiguousarray(codes, dtype=np.int64),
+                                np.ascontiguousarray(weights, dtype=float), values, ngroups)
+
+def income_multipliers(gr, alive, discount):
+    return kernel('income_multipliers')(np.ascontiguousarray(gr, dtype=float), np.ascontiguousarray(alive, dtype=float),
+                                        np.ascontiguousarray(discount, dtype=float))
+
+def shocked_multipliers(gr, alive, shocks, sigma, discount):
+    return kernel('shocked_multipliers')(np.ascontiguousarray(gr, dtype=float), np.ascontiguousarray(alive, dtype=float),
+                                         np.ascontiguousarray(shocks, dtype=float), float(sigma),
+                                         np.ascontiguousarray(discount, dtype=float))
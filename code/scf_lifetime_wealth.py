@@ -3,16 +3,14 @@ Lifetime wealth calculations and figures
 """
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import time, datetime, pyreadstat, sys
-import scf_data_clean, itertools
+import time, datetime, sys
+import scf_data_clean, scf_weighted, scf_render, scf_profile, scf_cancellation, scf_kernels, scf_parallel
 
 """
-Obtain data from scf_data_clean.
+Obtain lists and functions from scf_data_clean (the data itself is only built
+when main is run).
 """
 
-data = scf_data_clean.data
 age_labels, age_values = scf_data_clean.age_labels, scf_data_clean.age_values
 slice_fun = scf_data_clean.slice_fun
 qctile_dict, cancel_list = scf_data_clean.qctile_dict, scf_data_clean.cancel_list
@@ -20,52 +18,148 @@ c1, c2 = scf_data_clean.c1, scf_data_clean.c2
 colorFader = scf_data_clean.colorFader
 debt_list = scf_data_clean.debt_list
 debt_brackets = scf_data_clean.debt_brackets
+spec = scf_render.spec
 """
 Lifetime wealth function. Takes dataframe, aggregate growth rate (zero in Commentary),
 discount rate (rf=0.04 in Commentary) and end date for one's life (80 in Commentary).
+
+Income grows at a rate that depends only on the age bracket, so future per-capita
+income is current per-capita income times a factor that depends only on current
+age. We therefore build the path of growth factors once for each distinct age
+(an ages x end_date array), discount and sum it to a single multiplier per age,
+and scale each household's income by the multiplier for its age. Nothing is
+written to df.
 """
 
-def lifetime_wealth(df,g,rf,end_date):
-    #create series for current income, per-capita income and discounted income.
-    df['income0'] = df['income']
-    df['percap_income0'] = df['percap_income']
-    df['percap_income0disc'] = df['percap_income']
-    #create median incomes for each age group.
-    I_med = df.groupby(df['age_cat'])['income'].agg(lambda x: scf_data_clean.quantile(x,df.loc[x.index,"wgt"],0.5)).values
-    #specify assumed growth rates of income.
+#growth rates of income by age group: growth of median income between
+#consecutive groups (plus g), with the last group repeating the previous rate.
+def lifecycle_growth(df,g):
+    I_med = scf_weighted.weighted_median(df, 'age_cat', 'income').values
     lifecycle_grow = np.log(I_med[1:]/I_med[:-1])/5 + g
-    grow = np.append(lifecycle_grow, lifecycle_grow[-1])
-    #create dictionary mapping age groups to growth rates.
-    grow_dict = dict(zip(range(len(age_labels)),list(grow)))
-    #construct future income and per-capita income and discount.
-    for t in range(end_date-1):
-        #get growth between t and t+1 by applying grow_dict to age categorical.
-        gr = pd.cut(df['age']+t,bins=age_values,labels=range(len(age_values)-1)).map(grow_dict)
-        #compute next year income and discounted income if alive. applies income
-        #growth to percap income. Amounts to assuming people stay together forever.
-        df['percap_income{0}'.format(t+1)] = (df['age']+t+1<=end_date)*df['percap_income{0}'.format(t)]*np.exp(gr.astype(float))
-        df['percap_income{0}disc'.format(t+1)] = np.exp(-rf*(t+1))*df['percap_income{0}'.format(t+1)]
-    #note that some of the above will return NaNs (due to overflow of age), but
-    #these are (correctly) ignored when we use the axis sum in the following:
-    df['percap_LT_income'] = df[['percap_income{0}disc'.format(t) for t in range(end_date)]].sum(axis=1)
-    return df['percap_LT_income'] + df['percap_networth']
-"""
-Create qctiles for lifetime wealth. Takes dataframe, adds series
-using above lifetime_wealth function and computes categorical variables.
-"""
-def lifetime_wealth_qctiles(df,g,rf,end_date,num):
-    df['percap_'+'LT_wealth'] = lifetime_wealth(df,g,rf,end_date)
+    return np.append(lifecycle_grow, lifecycle_grow[-1])
+
+#growth rate from year t to t+1 (t = 0,...,end_date-2) for each age in ages, and
+#whether the household is alive in t+1. As with pd.cut, an age outside
+#age_values has no growth rate (NaN).
+def growth_rates(ages,grow,end_date):
+    ages_t = np.asarray(ages, dtype=float)[:,None] + np.arange(end_date-1)[None,:]
+    #index of the bracket (b_k, b_k+1] containing age+t, -1 if none.
+    cat = np.searchsorted(age_values, ages_t, side='left') - 1
+    gr = np.where((cat >= 0) & (cat < len(grow)), np.asarray(grow)[np.clip(cat, 0, len(grow)-1)], np.nan)
+    #alive in t+1 if age+t+1 <= end_date. Amounts to assuming people stay together forever.
+    return gr, ages_t + 1 <= end_date
+
+#income in years t = 0,...,end_date-1 relative to year 0, for each age in ages.
+#Zero once age+t exceeds end_date, and NaN from an age without a growth rate on.
+def income_paths(ages,grow,end_date):
+    gr, alive = growth_rates(ages,grow,end_date)
+    paths = np.ones((len(gr), end_date))
+    paths[:,1:] = np.cumprod(alive*np.exp(gr), axis=1)
+    return paths
+
+@scf_profile.profiled('lifetime.lifetime_wealth')
+def lifetime_wealth(df,g,rf,end_date):
+    grow = lifecycle_growth(df,g)
+    ages, age_index = np.unique(df['age'].values, return_inverse=True)
+    #discounted sum of each path, NaNs (due to overflow of age) being ignored as in pandas.
+    multiplier = scf_kernels.income_multipliers(*growth_rates(ages,grow,end_date), np.exp(-rf*np.arange(end_date))[:,None])[:,0]
+    percap_LT_income = df['percap_income'].values*multiplier[age_index]
+    return pd.Series(percap_LT_income, index=df.index) + df['percap_networth']
+
+"""
+Lifetime wealth for a whole grid of (g, rf, end_date) scenarios. Growth paths are
+built once per (g, end_date) and discounted at every rate in rf_list with one
+matrix product, so the cost of adding discount rates is a column of that product.
+
+Returns (i) a household x scenario frame of lifetime wealth whose columns are
+indexed by (g, rf, end_date), and (ii) a scenario x qctile frame (qctiles of
+lifetime wealth numbered 1 to num) with the total weight, the weighted mean
+per-capita student debt of all households and of borrowers, the weighted mean
+per-capita cancellation for each amount in cancel_list, and the share of
+households in each debt bracket.
+"""
+
+@scf_profile.profiled('lifetime.lifetime_wealth_grid')
+def lifetime_wealth_grid(df,g_list,rf_list,end_date_list,num=5,cancel_list=cancel_list):
+    rf_list = np.asarray(rf_list, dtype=float)
+    ages, age_index = np.unique(df['age'].values, return_inverse=True)
+    discount = np.exp(-np.outer(np.arange(max(end_date_list)), rf_list))
+    LT_wealth, scenarios = [], []
+    for g in g_list:
+        grow = lifecycle_growth(df,g)
+        for end_date in end_date_list:
+            multipliers = scf_kernels.income_multipliers(*growth_rates(ages,grow,end_date), discount[:end_date])
+            LT_wealth.append(df['percap_income'].values[:,None]*multipliers[age_index] + df['percap_networth'].values[:,None])
+            scenarios += [(g, rf, end_date) for rf in rf_list]
+    columns = pd.MultiIndex.from_tuples(scenarios, names=['g','rf','end_date'])
+    LT_wealth = pd.DataFrame(np.hstack(LT_wealth), index=df.index, columns=columns)
+    return LT_wealth, lifetime_wealth_aggregates(df,LT_wealth,num,cancel_list)
+
+def lifetime_wealth_aggregates(df,LT_wealth,num,cancel_list=cancel_list):
+    n, S = LT_wealth.shape
+    #stack scenarios so that each (scenario, qctile) pair is one group code.
+    values, scenario = LT_wealth.values.T.ravel(), np.repeat(np.arange(S), n)
+    w = np.tile(df['wgt'].values, S)
+    bins = scf_data_clean.grouped_quantile(values, w, scenario, np.arange(num+1)/num, S)
+    cat = scf_data_clean.grouped_cut(values, scenario, bins, include_lowest=True).codes
+    keep = cat >= 0
+    codes = (scenario*num + cat)[keep]
+    weight_sum = lambda x: np.bincount(codes, weights=(w*x)[keep], minlength=S*num)
+    total = weight_sum(1)
+    loans = np.tile(df['percap_all_loans'].values, S)
+    borrower = (loans > 0).astype(float)
+    aggregates = {'wgt': total, 'percap_all_loans': weight_sum(loans)/total,
+                  'percap_all_loans_borrowers': weight_sum(borrower*loans)/weight_sum(borrower)}
+    forgiven = scf_cancellation.forgiveness(df, cancel_list)[:,:,0]
+    for i, cancel in enumerate(cancel_list):
+        aggregates['percap_cancel{0}'.format(cancel)] = weight_sum(np.tile(forgiven[:,i], S))/total
+    debt_cat = np.searchsorted(debt_list, loans, side='left') - 1
+    debt_cat[loans == debt_list[0]] = 0
+    for j in range(len(debt_brackets)):
+        aggregates['debt_share{0}'.format(j)] = weight_sum((debt_cat == j).astype(float))/total
+    index = pd.MultiIndex.from_tuples([key + (q+1,) for key in LT_wealth.columns for q in range(num)],
+                                      names=list(LT_wealth.columns.names) + ['qctile'])
+    return pd.DataFrame(aggregates, index=index)
+
+"""
+The aggregates of lifetime_wealth_grid alone. With jobs > 1 the grid is cut into
+blocks, one per g and slice of rf_list, which scf_parallel computes on "jobs"
+worker processes; each scenario's aggregates do not depend on the others in its
+block.
+"""
+
+def grid_aggregates(df,g_list,rf_list,end_date_list,num=5,cancel_list=cancel_list,jobs=1):
+    if jobs <= 1:
+        return lifetime_wealth_grid(df,g_list,rf_list,end_date_list,num,cancel_list)[1]
+    blocks = [(g, list(rf)) for g in g_list for rf in np.array_split(rf_list, min(jobs, len(rf_list)))]
+    tasks = [(grid_block, {'g_list': [g], 'rf_list': rf, 'end_date_list': end_date_list, 'num': num,
+                           'cancel_list': cancel_list}) for g, rf in blocks]
+    return pd.concat(scf_parallel.run_tasks(df, list(df.columns), tasks, jobs=jobs))
+
+def grid_block(df, **kwargs):
+    return lifetime_wealth_grid(df, **kwargs)[1]
+
+"""
+Create qctiles for lifetime wealth. Takes dataframe, returns a shallow copy with
+series from above lifetime_wealth function and categorical variables added
+(the caller's frame is not changed).
+"""
+def lifetime_wealth_qctiles(df,g,rf,end_date,num,LT_wealth=None):
+    #LT_wealth: lifetime wealth already computed for (g,rf,end_date), e.g. by lifetime_wealth_grid.
+    df = df.copy(deep=False)
+    df['percap_'+'LT_wealth'] = lifetime_wealth(df,g,rf,end_date) if LT_wealth is None else LT_wealth
     for num in [10,5]:
         #whole population (no age group-specific results)
-        qctiles = np.array([scf_data_clean.quantile(df['percap_'+'LT_wealth'], df['wgt'], j/num) for j in range(num+1)])
+        qctiles = scf_data_clean.qctiles(df['percap_'+'LT_wealth'], df['wgt'], num)
         df['percap_'+'LT_wealth'+'_cat{0}'.format(num)] = pd.cut(df['percap_'+'LT_wealth'],bins=qctiles,labels=range(len(qctiles)-1),include_lowest=True, duplicates='drop')
     return df
 """
 Average student debt by lifetime wealth qctiles. Takes dataframe and parameters
-governing income growth and qctile number and produces and plots average debt levels.
+governing income growth and qctile number and produces average debt levels ($000s).
 """
-def lifetime_wealth_SD(df,g,rf,end_date,num,show=0):
-    df, df_SD = lifetime_wealth_qctiles(df,g,rf,end_date,num), {}
+@scf_profile.profiled('lifetime.lifetime_wealth_SD')
+def lifetime_wealth_SD(df,g,rf,end_date,num,LT_wealth=None):
+    df, df_SD = lifetime_wealth_qctiles(df,g,rf,end_date,num,LT_wealth), {}
     df_SD['borrowers'] = pd.DataFrame(columns=range(1,num+1),index=['LT_wealth'])
     df_SD['all'] = pd.DataFrame(columns=range(1,num+1),index=['LT_wealth'])
     for var2 in ['borrowers','all']:
@@ -73,102 +167,104 @@ def lifetime_wealth_SD(df,g,rf,end_date,num,show=0):
             df_temp = df[df['percap_all_loans']>0]
         else:
             df_temp = df
-        f = lambda x: np.average(x, weights=df_temp.loc[x.index, "wgt"])
-        gb = df_temp.groupby('percap_'+'LT_wealth'+'_cat{0}'.format(num))['percap_'+'all_loans'].agg(f).values
+        gb = scf_weighted.weighted_mean(df_temp, 'percap_'+'LT_wealth'+'_cat{0}'.format(num), 'percap_'+'all_loans').values
         if len(gb) < num:
             df_SD[var2].loc['LT_wealth',num+1-len(gb):] = gb
             df_SD[var2].loc['LT_wealth',:num+1-len(gb)] = gb[0]
         else:
             df_SD[var2].loc['LT_wealth',:] = gb
         df_SD[var2] = (df_SD[var2]/1000).astype(float).round(1)
-    width = 1/5
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    for i in range(1,num+1):
-        if i==1:
-            ax.bar(i-width, df_SD['borrowers'].loc['LT_wealth',i], 2*width, color=c1, label = "Borrowers")
-            ax.bar(i+width, df_SD['all'].loc['LT_wealth',i], 2*width, color=c2, label = "All")
-        else:
-            ax.bar(i-width, df_SD['borrowers'].loc['LT_wealth',i], 2*width, color=c1)
-            ax.bar(i+width, df_SD['all'].loc['LT_wealth',i], 2*width, color=c2)
-    ax.set_xlabel('Per capita lifetime wealth {0}s ($r = ${1}%)'.format(qctile_dict[num],int(100*rf)))
-    ax.set_title('Average per-capita student debt')
-    ax.set_ylabel('\$000s')
-    ax.legend(loc='upper left')
-    plt.ylim([0,35])
-    destin = '../main/figures/SD{0}lifetime_wealth{1}{2}.eps'.format(qctile_dict[num],int(100*g),int(100*rf))
-    plt.savefig(destin, format='eps', dpi=1000)
-    if show == 1:
-        plt.show()
-    plt.close()
-"""
-Count of debtors by lifetime wealth quintile
-"""
-def lifetime_wealth_debt_count(df,g,rf,end_date,num,show=0):
-    df = lifetime_wealth_qctiles(df,g,rf,end_date,num)
-    qctiles = np.array([scf_data_clean.quantile(df['percap_'+'LT_wealth'],data['wgt'], j/num) for j in range(num+1)])
+    return df_SD
+"""
+Count of debtors by lifetime wealth quintile: total weight in each (qctile,
+debt bracket) pair.
+"""
+@scf_profile.profiled('lifetime.lifetime_wealth_debt_count')
+def lifetime_wealth_debt_count(df,g,rf,end_date,num,LT_wealth=None):
+    df = lifetime_wealth_qctiles(df,g,rf,end_date,num,LT_wealth)
+    qctiles = scf_data_clean.qctiles(df['percap_'+'LT_wealth'],df['wgt'], num)
     qct_lists, var_names = [qctiles,debt_list],['percap_'+'LT_wealth','percap_all_loans']
     d = [pd.cut(df[var_names[i]], bins=qct_lists[i],labels=range(len(qct_lists[i])-1),include_lowest=True,duplicates='drop') for i in range(2)]
-    df['pairs'] = list(zip(d[0], d[1]))
-    SD_debt_count = df.groupby(df['pairs'])['wgt'].sum()
-    for key in list(itertools.product(range(num), range(len(debt_brackets)))):
-        if key not in list(SD_debt_count.keys()):
-            SD_debt_count = pd.concat([SD_debt_count, pd.Series([0], index=[key])])
-    width = 1/5
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    for i in range(len(qctiles)-1):
-        #sum debtors in each quintile to reach 1
-        norm = sum([SD_debt_count[(i,j)] for j in range(len(debt_list)-1)])
-        for j in range(len(debt_list)-1):
-            if i==0:
-                ax.bar(i+1-((len(debt_list)-2)/2-j)*width,SD_debt_count[(i,j)]/norm,width,color=colorFader(c1,c2,j/(len(debt_list)-2)),label=debt_brackets[j])
-            else:
-                ax.bar(i+1-((len(debt_list)-2)/2-j)*width,SD_debt_count[(i,j)]/norm,width,color=colorFader(c1,c2,j/(len(debt_list)-2)))
-    ax.set_xlabel('Per capita lifetime wealth {0}s ($r = ${1}%)'.format(qctile_dict[num],int(100*rf)))
-    ax.set_title('Fraction of population')
-    ax.legend()
-    ax.set_ylim([0, 1])
-    destin = '../main/figures/lifetime_wealth_debt_count{0}{1}.eps'.format(int(100*g),int(100*rf))
-    plt.savefig(destin, format='eps', dpi=1000)
-    if show == 1:
-        plt.show()
-    plt.close()
-
-def cancellation_lifetime_wealth(df,g,rf,end_date,num,show=0):
-    df = lifetime_wealth_qctiles(df,g,rf,end_date,num)
-    gb = df.groupby(df['percap_'+'LT_wealth'+'_cat{0}'.format(num)])
-    f = lambda x: np.average(x, weights=df.loc[x.index, "wgt"])
-    array_temp = np.zeros((num,len(cancel_list)))
+    return scf_weighted.weighted_crosstab(d[0], d[1], df['wgt'], (len(qctiles)-1, len(debt_list)-1))
+"""
+Average cancellation by lifetime wealth qctiles, one column per amount in cancel_list.
+"""
+@scf_profile.profiled('lifetime.cancellation_lifetime_wealth')
+def cancellation_lifetime_wealth(df,g,rf,end_date,num,LT_wealth=None,cancel_list=cancel_list):
+    df = lifetime_wealth_qctiles(df,g,rf,end_date,num,LT_wealth)
+    return scf_cancellation.simulate_cancellation(df, cancel_list, by='percap_'+'LT_wealth'+'_cat{0}'.format(num)).values.T
+
+"""
+The tables of lifetime_wealth_SD, lifetime_wealth_debt_count and
+cancellation_lifetime_wealth for one scenario, read off its rows of
+lifetime_wealth_aggregates (one per qctile) rather than cutting the households
+into qctiles again. A qctile left empty by tied cut points takes the debt of
+the next one, as pd.cut's duplicates='drop' does in lifetime_wealth_SD.
+"""
+def aggregate_tables(aggregates,num,cancel_list=cancel_list):
+    df_SD = {}
+    for var2, col in [('borrowers','percap_all_loans_borrowers'), ('all','percap_all_loans')]:
+        df_SD[var2] = pd.DataFrame([aggregates[col].bfill().values], index=['LT_wealth'], columns=range(1,num+1))
+        df_SD[var2] = (df_SD[var2]/1000).astype(float).round(1)
+    shares = aggregates[['debt_share{0}'.format(j) for j in range(len(debt_brackets))]].values
+    SD_debt_count = np.nan_to_num(shares*aggregates['wgt'].values[:,None])
+    array_temp = aggregates[['percap_cancel{0}'.format(cancel) for cancel in cancel_list]].values
+    return df_SD, SD_debt_count, array_temp
+
+"""
+Figure specs (see scf_render) for the tables above.
+"""
+def lifetime_wealth_specs(g,rf,num,df_SD,SD_debt_count,array_temp,cancel_list=cancel_list):
+    xlabel = 'Per capita lifetime wealth {0}s ($r = ${1}%)'.format(qctile_dict[num],int(100*rf))
+    table = np.column_stack([df_SD['borrowers'].loc['LT_wealth'].values, df_SD['all'].loc['LT_wealth'].values])
+    specs = [spec('SD{0}lifetime_wealth{1}{2}'.format(qctile_dict[num],int(100*g),int(100*rf)), 'pair', table,
+                  x=list(range(1,num+1)), xlabel=xlabel, title='Average per-capita student debt',
+                  ylabel='\\$000s', legend={'loc':'upper left'}, ylim=[0,35]),
+             spec('lifetime_wealth_debt_count{0}{1}'.format(int(100*g),int(100*rf)), 'shares', SD_debt_count,
+                  xlabel=xlabel, title='Fraction of population', legend={}, ylim=[0, 1])]
     for i, cancel in enumerate(cancel_list):
-        array_temp[:,i] = gb['percap_cancel{0}'.format(cancel)].agg(f)
-        width = 2/5
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        for j in range(num):
-            ax.bar(j+1, array_temp[j,i], 2*width, color=c2)
-        plt.xticks(np.arange(1, num+1))
-        ax.set_xlabel('Per capita lifetime wealth {0}s ($r = ${1}%)'.format(qctile_dict[num],int(100*rf)))
-        ax.set_ylabel('\$')
-        ax.set_title('Up to \${0},000 forgiven'.format(int(cancel/10**3)))
-        destin = '../main/figures/cancellifetime_wealth{0}{1}{2}{3}.eps'.format(qctile_dict[num],cancel,int(100*g),int(100*rf))
-        plt.savefig(destin, format='eps', dpi=1000)
-        if show == 1:
-            plt.show()
-    plt.close()
-
-"""
-Growth levels and interest rates
+        specs.append(spec('cancellifetime_wealth{0}{1}{2}{3}'.format(qctile_dict[num],cancel,int(100*g),int(100*rf)), 'single', array_temp[:,i],
+                          x=list(range(1,num+1)), xticks=(list(np.arange(1, num+1)),), xlabel=xlabel,
+                          ylabel='\\$', title='Up to \\${0},000 forgiven'.format(int(cancel/10**3))))
+    return specs
+
+"""
+Growth levels and interest rates. Lifetime wealth and its qctile aggregates
+for all (g,rf) pairs are computed in one pass (lifetime_wealth_grid), the tables
+of each pair are read off the aggregates, and the figures that changed (all if
+force=True) are drawn by scf_render on "jobs" worker processes unless
+figures=False. The grid itself is also spread over "jobs" processes (see
+grid_aggregates). Returns the figure specs, which hold the table behind each
+figure. The values below are the defaults of main's keyword arguments.
 """
 
 g_list, rf_list = [0], [0.04,0.07,0.1]
 end_date = 80
 num = 5 #5 = quintiles, 10 = deciles
-for g in g_list:
-    for rf in rf_list:
-        print("Computing plots for (g,rf) = ", (g,rf))
-        plt.rcParams.update({'figure.max_open_warning': 0})
-        pd.set_option('mode.chained_assignment', None)
-        lifetime_wealth_SD(data,g,rf,end_date,num,show=0)
-        lifetime_wealth_debt_count(data,g,rf,end_date,num,show=0)
-        cancellation_lifetime_wealth(data,g,rf,end_date,num,show=0)
+
+"""
+As scf_figures.main, years=[...] computes the figures of every wave and draws
+them in one pass.
+"""
+
+def main(data=None,jobs=1,figures=True,fmt='eps',force=False,years=None,g_list=g_list,rf_list=rf_list,
+         end_date=end_date,num=num,cancel_list=cancel_list,fig_dir=scf_render.fig_dir,cache_dir=scf_data_clean.cache_dir):
+    specs = []
+    for year, df in scf_render.frames(data, years, cache_dir).items():
+        specs += scf_render.with_year(wave_specs(df, g_list, rf_list, end_date, num, cancel_list, jobs), year)
+    if figures:
+        scf_render.render(specs, fmt, jobs, fig_dir, force=force)
+    return specs
+
+def wave_specs(data,g_list=g_list,rf_list=rf_list,end_date=end_date,num=num,cancel_list=cancel_list,jobs=1):
+    LT_aggregates = grid_aggregates(data,g_list,rf_list,[end_date],num,cancel_list,jobs)
+    specs = []
+    for g in g_list:
+        for rf in rf_list:
+            print("Computing plots for (g,rf) = ", (g,rf))
+            tables = aggregate_tables(LT_aggregates.loc[(g,rf,end_date)],num,cancel_list)
+            specs += lifetime_wealth_specs(g,rf,num,*tables,cancel_list)
+    return specs
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Monte Carlo lifetime wealth: many stochastic income paths per household instead
+of the single path of scf_lifetime_wealth.lifetime_wealth.
+
+In each draw, log income grows from one year to the next at the lifecycle rate
+of the household's age bracket (lifecycle_growth, plus g) plus an idiosyncratic
+shock N(0, sigma^2), independent across households, years and draws. Lifetime
+wealth is discounted lifetime per-capita income plus per-capita networth, as in
+lifetime_wealth (sigma=0 gives it back in every draw), and households are cut
+into qctiles of lifetime wealth within each draw. The results are
+
+    membership: for each household, the share of draws in which it falls in
+    each qctile;
+    benefit: for each qctile and cancellation cap, the weighted mean per-capita
+    forgiveness within the qctile averaged over draws, with its Monte Carlo
+    standard error.
+
+Draws are simulated in chunks of chunk_draws, and within a chunk households in
+blocks of chunk_rows, so that memory depends on the chunk sizes and the number
+of households but not on the number of draws: the (block x draws x years) shocks
+of one block and the (households x draws) lifetime wealth of one chunk are the
+largest arrays. Each chunk is a task for scf_parallel.run_tasks, whose results
+are merged as they arrive, so chunks run on "jobs" worker processes.
+
+Every draw has its own random stream, SeedSequence(seed, spawn_key=(draw,)), and
+the shocks of a block follow those of the previous block in that stream, so the
+results depend on seed but not on the chunk sizes or the number of jobs.
+"""
+import argparse
+import numpy as np
+import pandas as pd
+import scf_data_clean, scf_lifetime_wealth, scf_cancellation, scf_parallel, scf_profile, scf_kernels
+
+columns = ['age','percap_income','percap_networth','wgt']
+
+"""
+One chunk (draws start to stop-1): per-household counts of draws in each qctile,
+and per qctile and cap the number of draws with households in the qctile, the
+mean over them of the mean forgiveness and the sum of squared deviations.
+df holds "columns" and one column forgiven<i> per cap.
+"""
+
+def simulate_chunk(df, start, stop, grow, rf, end_date, num, sigma, seed, caps, chunk_rows):
+    n, D = len(df), stop - start
+    streams = [np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(d,))) for d in range(start, stop)]
+    discount = np.exp(-rf*np.arange(end_date))
+    ages = df['age'].values
+    LT_wealth = np.empty((n, D))
+    for a in range(0, n, chunk_rows):
+        b = min(a + chunk_rows, n)
+        gr, alive = scf_lifetime_wealth.growth_rates(ages[a:b], grow, end_date)
+        shocks = np.stack([stream.standard_normal((b-a, end_date-1)) for stream in streams], axis=1)
+        #NaNs (age overflow) are ignored, as in lifetime_wealth.
+        multiplier = scf_kernels.shocked_multipliers(gr, alive, shocks, sigma, discount)
+        LT_wealth[a:b] = df['percap_income'].values[a:b,None]*multiplier + df['percap_networth'].values[a:b,None]
+    #qctiles within each draw, as for the scenarios of lifetime_wealth_aggregates.
+    values, draw = LT_wealth.T.ravel(), np.repeat(np.arange(D), n)
+    w = np.tile(df['wgt'].values, D)
+    bins = scf_data_clean.grouped_quantile(values, w, draw, np.arange(num+1)/num, D)
+    cat = scf_data_clean.grouped_cut(values, draw, bins, include_lowest=True).codes
+    keep = cat >= 0
+    codes = (draw*num + cat)[keep]
+    total = np.bincount(codes, weights=w[keep], minlength=D*num)
+    benefit = np.empty((D*num, len(caps)))
+    for i in range(len(caps)):
+        forgiven = np.tile(df['forgiven{0}'.format(i)].values, D)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            benefit[:,i] = np.bincount(codes, weights=(w*forgiven)[keep], minlength=D*num)/total
+    benefit = benefit.reshape(D, num, len(caps))
+    draws = np.isfinite(benefit).sum(axis=0)
+    mean = np.nansum(benefit, axis=0)/np.maximum(draws, 1)
+    cat = cat.reshape(D, n)
+    return {'membership': np.stack([(cat == q).sum(axis=0) for q in range(num)], axis=1),
+            'draws': draws, 'mean': mean, 'm2': np.nansum((benefit - mean)**2, axis=0)}
+
+#merge two chunks: counts add, and means and sums of squared deviations combine
+#pairwise (Chan et al.), which stays accurate however many chunks are merged.
+def add(total, chunk):
+    n = total['draws'] + chunk['draws']
+    delta = chunk['mean'] - total['mean']
+    share = chunk['draws']/np.maximum(n, 1)
+    return {'membership': total['membership'] + chunk['membership'], 'draws': n,
+            'mean': total['mean'] + delta*share,
+            'm2': total['m2'] + chunk['m2'] + delta**2*total['draws']*share}
+
+@scf_profile.profiled('montecarlo.simulate')
+def simulate(data, draws=1000, g=0, rf=0.04, end_date=80, num=5, sigma=0.1, caps=scf_data_clean.cancel_list,
+             rule='borrower', seed=0, chunk_draws=50, chunk_rows=500, jobs=1):
+    grow = scf_lifetime_wealth.lifecycle_growth(data, g)
+    forgiven = scf_cancellation.forgiveness(data, caps, rule=rule)[:,:,0]
+    df = data[columns].assign(**{'forgiven{0}'.format(i): forgiven[:,i] for i in range(len(caps))})
+    kwargs = {'grow': grow, 'rf': rf, 'end_date': end_date, 'num': num, 'sigma': sigma, 'seed': seed,
+              'caps': list(caps), 'chunk_rows': chunk_rows}
+    tasks = [(simulate_chunk, dict(kwargs, start=start, stop=min(start + chunk_draws, draws)))
+             for start in range(0, draws, chunk_draws)]
+    with scf_profile.stage('montecarlo.chunks', tasks=len(tasks), jobs=jobs):
+        total = scf_parallel.run_tasks(df, list(df.columns), tasks, jobs=jobs, reduce=add)
+    qctiles = pd.Index(range(1, num+1), name='qctile')
+    membership = pd.DataFrame(total['membership']/draws, index=data.index, columns=qctiles)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(total['draws'] > 0, total['mean'], np.nan)
+        se = np.sqrt(total['m2']/(total['draws'] - 1)/total['draws'])
+    caps = pd.Index(caps, name='cap')
+    benefit = pd.concat({'mean': pd.DataFrame(mean, index=qctiles, columns=caps),
+                         'se': pd.DataFrame(se, index=qctiles, columns=caps)}, axis=1)
+    return membership, benefit
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo lifetime wealth qctiles and cancellation benefits.')
+    parser.add_argument('--draws', type=int, default=1000)
+    parser.add_argument('--g', type=float, default=0)
+    parser.add_argument('--rf', type=float, default=0.04)
+    parser.add_argument('--end-date', type=int, default=80)
+    parser.add_argument('--num', type=int, default=5, help='number of qctiles')
+    parser.add_argument('--sigma', type=float, default=0.1, help='standard deviation of the yearly income shocks')
+    parser.add_argument('--cancel', type=float, nargs='+', default=scf_data_clean.cancel_list, help='caps')
+    parser.add_argument('--rule', default='borrower', choices=scf_cancellation.rules)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-draws', type=int, default=50)
+    parser.add_argument('--chunk-rows', type=int, default=500)
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--year', type=int, default=2019, help='survey wave')
+    parser.add_argument('--cache-dir', default=scf_data_clean.cache_dir, help='folder for downloads and cached data')
+    parser.add_argument('--synthetic', type=int, metavar='ROWS', help='use synthetic data (see scf_synthetic) instead')
+    parser.add_argument('--membership', metavar='CSV', help='write the qctile membership probabilities here')
+    args = parser.parse_args()
+    if args.synthetic:
+        import scf_synthetic
+        data = scf_synthetic.SyntheticDataset(args.synthetic).data
+    else:
+        data = scf_data_clean.build_dataset(args.year, args.cache_dir).data
+    membership, benefit = simulate(data, args.draws, args.g, args.rf, args.end_date, args.num, args.sigma, args.cancel,
+                                   args.rule, args.seed, args.chunk_draws, args.chunk_rows, args.jobs)
+    print(benefit)
+    if args.membership:
+        membership.to_csv(args.membership)
@@ -0,0 +1,94 @@
+"""
+Run independent tasks (e.g. one per scenario of a parameter grid) in a pool of
+worker processes.
+
+The columns the tasks need are written once to .npy files in a temporary
+folder. Each worker memory-maps them when it starts, so the data is neither
+pickled per task nor copied into every worker. Results come back in the order
+the tasks were given, whatever the number of workers. With reduce, they are
+instead folded into one total, reduce(total, result), in that order as they
+arrive, so only the total is kept (e.g. Monte Carlo chunks, see
+scf_monte_carlo). At most 2*jobs tasks are in flight ahead of the one being
+collected, so finished results never pile up behind a slow one.
+
+A task is (function, kwargs): the worker calls function(df, **kwargs), where df
+holds the shared columns.
+"""
+import os, json, tempfile
+from collections import deque
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Write columns of df (categoricals as codes plus their categories) to
+directory, and read them back memory-mapped.
+"""
+
+def share_frame(df, columns, directory):
+    meta = {'columns': {}}
+    for col in columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            np.save(os.path.join(directory, col + '.npy'), np.asarray(df[col].cat.codes))
+            meta['columns'][col] = {'categories': df[col].cat.categories.tolist(), 'ordered': bool(df[col].cat.ordered)}
+        else:
+            np.save(os.path.join(directory, col + '.npy'), np.asarray(df[col]))
+            meta['columns'][col] = None
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+def load_frame(directory):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = {}
+    for col, cat in meta['columns'].items():
+        values = np.load(os.path.join(directory, col + '.npy'), mmap_mode='r')
+        if cat is not None:
+            values = pd.Categorical.from_codes(values, categories=cat['categories'], ordered=cat['ordered'])
+        columns[col] = values
+    return pd.DataFrame(columns, copy=False)
+
+"""
+Worker side. The shared frame is loaded once per worker by the pool initializer.
+Each task gets a shallow copy, so columns a task adds never reach the next one.
+"""
+
+shared = None
+
+def init_worker(directory):
+    global shared
+    shared = load_frame(directory)
+
+def run_task(fun, kwargs, frame=None):
+    df = shared if frame is None else frame
+    return fun(df.copy(deep=False), **kwargs)
+
+def collect(results, reduce=None):
+    if reduce is None:
+        return list(results)
+    total = None
+    for result in results:
+        total = result if total is None else reduce(total, result)
+    return total
+
+#results of pool.submit(*call) for each call, in order, with at most "window"
+#calls submitted ahead of the one collected, so that results waiting to be
+#collected (or folded) do not pile up.
+def in_order(pool, calls, window):
+    futures = deque()
+    for call in calls:
+        futures.append(pool.submit(*call))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+def run_tasks(df, columns, tasks, jobs=1, reduce=None):
+    if jobs <= 1:
+        frame = df[columns].reset_index(drop=True)
+        return collect((run_task(fun, kwargs, frame) for fun, kwargs in tasks), reduce)
+    with tempfile.TemporaryDirectory() as directory:
+        share_frame(df, columns, directory)
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(directory,)) as pool:
+            calls = ((run_task, fun, kwargs) for fun, kwargs in tasks)
+            return collect(in_order(pool, calls, 2*jobs), reduce)
@@ -0,0 +1,89 @@
+"""
+Stage-level instrumentation.
+
+Stages are marked with the context manager stage(name) or the decorator
+profiled(name). When profiling is enabled (main.py --profile, or enable()) each
+stage adds to "trace" a record with its name, its parent stage, wall time, the
+peak resident memory of the process at its end and by how much the stage raised
+it, the peak traced allocation if tracemalloc is running (a nested stage resets
+that peak, so an enclosing stage reports it from the last nested stage on), and
+the shape and size of the frame or array it returned (or of any frame given to
+the record's shape method). When profiling is disabled a stage costs one check.
+
+Stages run in worker processes (--jobs N) are not recorded; the stage that
+submits them covers their wall time.
+"""
+import time, json, sys, functools, tracemalloc, threading
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
+
+enabled = False
+trace = []
+#stages may run on several threads (see scf_data_clean.build_datasets), each with its own nesting.
+local = threading.local()
+
+def enable():
+    global enabled
+    enabled = True
+    del trace[:]
+
+#peak resident memory of the process so far, in MB (ru_maxrss is in bytes on macOS).
+def peak_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss/2**20 if sys.platform == 'darwin' else rss/2**10
+
+class Record(dict):
+    def shape(self, obj):
+        if hasattr(obj, 'shape'):
+            self['shape'] = list(obj.shape)
+        if hasattr(obj, 'memory_usage'):
+            #memory_usage is a Series for a frame, a number for a Series.
+            usage = obj.memory_usage(index=False)
+            self['memory_mb'] = float(usage.sum() if hasattr(usage, 'sum') else usage)/2**20
+        elif hasattr(obj, 'nbytes'):
+            self['memory_mb'] = obj.nbytes/2**20
+        return obj
+
+@contextmanager
+def stage(name, **info):
+    if not enabled:
+        yield Record()
+        return
+    if not hasattr(local, 'stack'):
+        local.stack = []
+    stack = local.stack
+    record = Record(name=name, parent=stack[-1] if stack else None, **info)
+    rss = peak_rss()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    stack.append(name)
+    tic = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - tic
+        stack.pop()
+        record['peak_rss_mb'] = peak_rss()
+        if rss is not None:
+            record['rss_growth_mb'] = record['peak_rss_mb'] - rss
+        if tracemalloc.is_tracing():
+            record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1]/2**20
+        trace.append(record)
+
+def profiled(name):
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                return record.shape(fun(*args, **kwargs))
+        return wrapper
+    return decorator
+
+def write_trace(path):
+    with open(path, 'w') as f:
+        json.dump({'argv': sys.argv, 'stages': trace}, f, indent=1, default=str)
@@ -0,0 +1,168 @@
+"""
+Render stage for the figures.
+
+The figure code in scf_figures and scf_lifetime_wealth only computes the numbers
+behind each figure and describes the figure as a "spec": a dict with the file
+name (without extension), the kind of plot, the plotted table and the text and
+layout options. render draws a list of specs, optionally on a pool of worker
+processes. Figures are drawn on matplotlib Figure objects (no pyplot state) with
+the Agg backend, so rendering never needs a display and is independent of the
+computations.
+
+Kinds of figure:
+    pair: two bars per x position (e.g. borrowers vs all). table is (n x 2).
+    single: one bar per x position. table is (n,).
+    shares: for each qctile, the share of households in each debt bracket.
+    table is (qctiles x brackets) and rows are normalized to sum to one.
+"""
+import os, json, hashlib, inspect
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from concurrent.futures import ProcessPoolExecutor
+import scf_data_clean, scf_profile
+
+c1, c2 = scf_data_clean.c1, scf_data_clean.c2
+colorFader = scf_data_clean.colorFader
+debt_brackets = scf_data_clean.debt_brackets
+
+fig_dir = os.path.join(scf_data_clean.root, 'main', 'figures')
+formats = ['eps', 'pdf', 'png']
+
+def spec(name, kind, table, **options):
+    return {'name': name, 'kind': kind, 'table': np.asarray(table, dtype=float), 'options': options}
+
+"""
+Functions drawing each kind of figure on an axis.
+"""
+
+def draw_pair(ax, table, x, width=1/5, labels=("Borrowers","All")):
+    for k in range(len(x)):
+        if k==0:
+            ax.bar(x[k]-width, table[k,0], 2*width, color=c1, label = labels[0])
+            ax.bar(x[k]+width, table[k,1], 2*width, color=c2, label = labels[1])
+        else:
+            ax.bar(x[k]-width, table[k,0], 2*width, color=c1)
+            ax.bar(x[k]+width, table[k,1], 2*width, color=c2)
+
+def draw_single(ax, table, x, width=2/5):
+    for k in range(len(x)):
+        ax.bar(x[k], table[k], 2*width, color=c2)
+
+def draw_shares(ax, table, width=1/5):
+    n = table.shape[1]
+    for i in range(table.shape[0]):
+        #for each qctile normalize so that sum is 1
+        norm = table[i].sum()
+        for j in range(n):
+            if i==0:
+                ax.bar(i+1-((n-1)/2-j)*width,table[i,j]/norm,width,color=colorFader(c1,c2,j/(n-1)),label=debt_brackets[j])
+            else:
+                ax.bar(i+1-((n-1)/2-j)*width,table[i,j]/norm,width,color=colorFader(c1,c2,j/(n-1)))
+
+def render_figure(spec, fmt='eps', fig_dir=fig_dir, dpi=1000):
+    options = dict(spec['options'])
+    fig = Figure()
+    ax = fig.add_subplot(111)
+    if spec['kind'] == 'pair':
+        draw_pair(ax, spec['table'], options['x'], options.get('width', 1/5), options.get('labels', ("Borrowers","All")))
+    elif spec['kind'] == 'single':
+        draw_single(ax, spec['table'], options['x'], options.get('width', 2/5))
+    elif spec['kind'] == 'shares':
+        draw_shares(ax, spec['table'])
+    else:
+        raise ValueError("unknown figure kind {0!r}".format(spec['kind']))
+    if 'xticks' in options:
+        ax.set_xticks(*options['xticks'])
+    for key in ['xlabel', 'title', 'ylabel']:
+        if key in options:
+            getattr(ax, 'set_' + key)(options[key])
+    if 'legend' in options:
+        ax.legend(**options['legend'])
+    if 'ylim' in options:
+        ax.set_ylim(options['ylim'])
+    destin = os.path.join(fig_dir, '{0}.{1}'.format(spec['name'], fmt))
+    fig.savefig(destin, format=fmt, dpi=dpi)
+    return destin
+
+"""
+Waves. frames gives the frame of each requested wave (the default dataset if
+neither data nor years is given) and with_year marks the figures of a wave
+other than 2019 by appending _year to their names.
+"""
+
+base_year = 2019
+
+def frames(data=None, years=None, cache_dir=scf_data_clean.cache_dir):
+    if data is not None:
+        return {base_year: data}
+    return {year: ds.data for year, ds in scf_data_clean.build_datasets(years or [base_year], cache_dir).items()}
+
+def with_year(specs, year):
+    if year != base_year:
+        for s in specs:
+            s['name'] = '{0}_{1}'.format(s['name'], year)
+    return specs
+
+"""
+Incremental builds. A manifest (manifest.json in fig_dir) records for each file
+the hash of everything that determines it: the plotted table (which reflects
+the input data and the parameters g, rf, end_date, num and cancel), the options,
+the format and dpi, and the version of the drawing code (the source of this
+module, and the colours, colorFader and debt brackets it takes from
+scf_data_clean). A figure whose file exists with an unchanged hash is not redrawn.
+"""
+
+def drawing_version():
+    with open(__file__, 'rb') as f:
+        source = f.read().decode()
+    drawing = [source, c1, c2, inspect.getsource(colorFader), debt_brackets]
+    return hashlib.sha256(json.dumps(drawing).encode()).hexdigest()
+
+code_version = drawing_version()
+
+def spec_hash(spec, fmt, dpi):
+    h = hashlib.sha256()
+    h.update(json.dumps([spec['name'], spec['kind'], spec['options'], fmt, dpi, code_version], sort_keys=True, default=str).encode())
+    h.update(np.ascontiguousarray(spec['table']).tobytes())
+    return h.hexdigest()
+
+def read_manifest(fig_dir=fig_dir):
+    path = os.path.join(fig_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+"""
+Render all specs that changed (all of them if force=True), on "jobs" worker
+processes if jobs > 1. Returns the paths written, in the order of specs.
+"""
+
+def init_worker():
+    matplotlib.use('Agg')
+
+def render(specs, fmt='eps', jobs=1, fig_dir=fig_dir, dpi=1000, force=False):
+    if fmt not in formats:
+        raise ValueError("format must be one of {0}".format(formats))
+    os.makedirs(fig_dir, exist_ok=True)
+    manifest, todo = read_manifest(fig_dir), []
+    for s in specs:
+        filename, h = '{0}.{1}'.format(s['name'], fmt), spec_hash(s, fmt, dpi)
+        if force or manifest.get(filename) != h or not os.path.exists(os.path.join(fig_dir, filename)):
+            todo.append((s, filename, h))
+    if len(todo) < len(specs):
+        print("Skipping {0} unchanged figures".format(len(specs)-len(todo)))
+    with scf_profile.stage('render', figures=len(todo), skipped=len(specs)-len(todo), format=fmt, jobs=jobs):
+        if jobs <= 1:
+            paths = [render_figure(s, fmt, fig_dir, dpi) for s, filename, h in todo]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker) as pool:
+                futures = [pool.submit(render_figure, s, fmt, fig_dir, dpi) for s, filename, h in todo]
+                paths = [future.result() for future in futures]
+    #re-read in case another render (e.g. the other figure module) updated it meanwhile.
+    manifest = read_manifest(fig_dir)
+    manifest.update({filename: h for s, filename, h in todo})
+    with open(os.path.join(fig_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return paths
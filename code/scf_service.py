@@ -0,0 +1,187 @@
+"""
+Local HTTP/JSON service answering aggregation questions on the cleaned data,
+e.g. "average forgiveness per quintile of lifetime wealth at rf=6%, cap $20k":
+
+    python scf_service.py --port 8050
+    curl -d '{"rf": 0.06, "caps": [20000]}' localhost:8050/lifetime
+
+The dataset is cleaned once when the service starts. The sort order and CDF of
+each variable are kept after the first quantile query on it, and lifetime
+income multipliers once per (g, end_date). Answers are cached by query (LRU).
+
+Endpoints (POST a JSON object, or GET with the same keys as query parameters,
+lists comma-separated):
+    /columns      names and types of the columns.
+    /quantile     var, q (list), by (optional): weighted quantiles of var, for
+                  each category of by if given.
+    /mean         by, values (list): weighted means by category.
+    /crosstab     rows, cols: total weight in each pair of categories.
+    /cancellation caps, phaseouts, rule, by: as scf_cancellation.simulate_cancellation
+                  (a phaseout of null means none).
+    /lifetime     g, rf, end_date, num, caps, phaseouts, rule: by qctile of
+                  lifetime wealth, mean per-capita debt of all households and of
+                  borrowers, the share in each debt bracket and mean forgiveness
+                  for each (cap, phaseout).
+Tables are returned as {"index": ..., "columns": ..., "data": ...}.
+"""
+import json, argparse, functools, time
+import numpy as np
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+import scf_data_clean, scf_weighted, scf_lifetime_wealth, scf_cancellation
+
+def table(df):
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    df = df.copy()
+    df.columns = [' '.join(map(str, c)) if isinstance(c, tuple) else str(c) for c in df.columns]
+    return json.loads(df.to_json(orient='split'))
+
+#a single value (e.g. GET ...?caps=10000) is a list of one.
+def as_list(values):
+    return list(np.atleast_1d(np.asarray(values, dtype=object)))
+
+#phaseouts may be null (no phase-out), as JSON has no infinity.
+def no_phaseout(phaseouts):
+    return [np.inf if p is None else p for p in as_list(phaseouts)]
+
+class Service:
+    def __init__(self, data, cache_size=1024):
+        self.data, self.cdfs, self.multipliers = data, {}, {}
+        self.ages, self.age_index = np.unique(data['age'].values, return_inverse=True)
+        self.answer = functools.lru_cache(maxsize=cache_size)(self._answer)
+
+    #sorted values and CDF of var, as in scf_data_clean.quantile.
+    def cdf(self, var):
+        if var not in self.cdfs:
+            order = np.argsort(self.data[var].values, kind='stable')
+            Sn = np.cumsum(self.data['wgt'].values[order])
+            self.cdfs[var] = (self.data[var].values[order], Sn/Sn[-1])
+        return self.cdfs[var]
+
+    def quantile(self, var, q, by=None):
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        if by is None:
+            x, Pn = self.cdf(var)
+            return table(pd.Series(np.interp(q, Pn, x), index=q, name=var))
+        codes, index = scf_weighted.group_index(self.data, by)
+        out = scf_data_clean.grouped_quantile(self.data[var], self.data['wgt'], codes, q, len(index))
+        return table(pd.DataFrame(out, index=index, columns=q))
+
+    def mean(self, by, values):
+        return table(scf_weighted.weighted_mean(self.data, by, [values] if isinstance(values, str) else list(values)))
+
+    def crosstab(self, rows, cols):
+        counts = scf_weighted.weighted_crosstab(self.data[rows], self.data[cols], self.data['wgt'])
+        return table(pd.DataFrame(counts, index=self.data[rows].cat.categories, columns=self.data[cols].cat.categories))
+
+    def cancellation(self, caps, phaseouts=[None], rule='borrower', by='percap_income_cat5'):
+        return table(scf_cancellation.simulate_cancellation(self.data, as_list(caps), no_phaseout(phaseouts), rule, by))
+
+    #lifetime income multiplier of each household for (g, rf, end_date).
+    def multiplier(self, g, rf, end_date):
+        if (g, end_date) not in self.multipliers:
+            grow = scf_lifetime_wealth.lifecycle_growth(self.data, g)
+            self.multipliers[(g, end_date)] = np.nan_to_num(scf_lifetime_wealth.income_paths(self.ages, grow, end_date))
+        paths = self.multipliers[(g, end_date)]
+        return (paths @ np.exp(-rf*np.arange(end_date)))[self.age_index]
+
+    def lifetime(self, g=0, rf=0.04, end_date=80, num=5, caps=scf_data_clean.cancel_list, phaseouts=[None], rule='borrower'):
+        df = self.data
+        LT_wealth = df['percap_income'].values*self.multiplier(g, rf, end_date) + df['percap_networth'].values
+        LT = pd.DataFrame(LT_wealth[:,None], index=df.index, columns=pd.MultiIndex.from_tuples([(g, rf, end_date)], names=['g','rf','end_date']))
+        aggregates = scf_lifetime_wealth.lifetime_wealth_aggregates(df, LT, num, [])
+        aggregates.index = aggregates.index.get_level_values('qctile')
+        bins = scf_data_clean.qctiles(LT_wealth, df['wgt'], num)
+        cats = pd.cut(LT_wealth, bins=bins, labels=range(len(bins)-1), include_lowest=True, duplicates='drop')
+        forgiven = scf_cancellation.simulate_cancellation(df.assign(LT_wealth_cat=cats), as_list(caps), no_phaseout(phaseouts), rule, 'LT_wealth_cat')
+        forgiven.columns = forgiven.columns + 1
+        forgiven.index = ['forgiven {0:g} {1:g}'.format(cap, phaseout) for cap, phaseout in forgiven.index]
+        return table(pd.concat([aggregates, forgiven.T], axis=1))
+
+    def columns(self):
+        return {col: str(dtype) for col, dtype in self.data.dtypes.items()}
+
+    endpoints = ['columns', 'quantile', 'mean', 'crosstab', 'cancellation', 'lifetime']
+
+    #key is the query as canonical JSON, so that equal queries share a cache entry.
+    def _answer(self, endpoint, key):
+        if endpoint not in self.endpoints:
+            raise KeyError("unknown endpoint {0!r}".format(endpoint))
+        return getattr(self, endpoint)(**json.loads(key))
+
+    def query(self, endpoint, params):
+        return self.answer(endpoint, json.dumps(params, sort_keys=True))
+
+"""
+HTTP layer. GET parameters are parsed as JSON where possible (numbers, null) and
+comma-separated values become lists.
+"""
+
+def parse_value(v):
+    if ',' in v:
+        return [parse_value(x) for x in v.split(',')]
+    try:
+        return json.loads(v)
+    except ValueError:
+        return v
+
+def handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self, endpoint, params):
+            tic = time.perf_counter()
+            if endpoint not in service.endpoints:
+                body, status = {'error': "unknown endpoint {0!r}".format(endpoint)}, 404
+            else:
+                try:
+                    body, status = {'result': service.query(endpoint, params)}, 200
+                except (KeyError, ValueError, TypeError, AttributeError, IndexError) as e:
+                    body, status = {'error': str(e)}, 400
+                except Exception as e: #any other failure is still answered, as a server error
+                    body, status = {'error': '{0}: {1}'.format(type(e).__name__, e)}, 500
+            body['seconds'] = time.perf_counter() - tic
+            out = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            self.respond(url.path.strip('/'), {k: parse_value(v) for k, v in parse_qsl(url.query)})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                params = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                params = None
+            if not isinstance(params, dict):
+                self.send_error(400, 'body must be a JSON object')
+                return
+            self.respond(urlparse(self.path).path.strip('/'), params)
+
+    return Handler
+
+def serve(service, host='127.0.0.1', port=8050):
+    server = ThreadingHTTPServer((host, port), handler(service))
+    print("Serving on http://{0}:{1}".format(host, server.server_port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve aggregation queries on the cleaned SCF data.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--year', type=int, default=2019, help='survey wave')
+    parser.add_argument('--cache-dir', default=scf_data_clean.cache_dir, help='folder for downloads and cached data')
+    parser.add_argument('--cache-size', type=int, default=1024, help='number of answers kept (LRU)')
+    parser.add_argument('--synthetic', type=int, metavar='ROWS', help='serve synthetic data (see scf_synthetic) instead')
+    args = parser.parse_args()
+    if args.synthetic:
+        import scf_synthetic
+        data = scf_synthetic.SyntheticDataset(args.synthetic).data
+    else:
+        data = scf_data_clean.build_dataset(args.year, args.cache_dir).data
+    serve(Service(data, args.cache_size), args.host, args.port)
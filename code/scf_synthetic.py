@@ -0,0 +1,63 @@
+"""
+Synthetic data with the schema of the join of the full public file and the
+summary file (after the asset_adj adjustment), for timing and checking the
+pipeline offline and at any size.
+
+The numbers are only meant to look like the SCF: each household has five
+implicates (y1 = 10*yy1 + implicate) sharing age, marital status and loans, with
+income and networth drawn once per household and perturbed per implicate.
+Nothing here should be read as an estimate.
+"""
+import numpy as np
+import pandas as pd
+import scf_data_clean
+
+whom_codes, whom_probs = [1, 2, 3, 4, 5, -7], [0.6, 0.15, 0.15, 0.02, 0.03, 0.05]
+
+"""
+Frame with "rows" rows (rounded down to whole households), in 2019 dollars.
+"""
+
+def synthetic_base(rows, seed=0, loan_prob=0.2):
+    rng = np.random.default_rng(seed)
+    hh = max(rows // 5, 1)
+    yy1 = np.repeat(np.arange(1, hh+1, dtype=np.int32), 5)
+    y1 = yy1*10 + np.tile(np.arange(1, 6, dtype=np.int32), hh)
+    age = np.repeat(rng.integers(18, 95, hh), 5)
+    married = np.repeat(np.where(rng.random(hh) < 0.5, 1, 2), 5)
+    #income rises with age until the fifties, and implicates differ by a few percent.
+    log_income = 10.5 + 0.04*np.minimum(age - 18, 35) + np.repeat(rng.normal(0, 0.9, hh), 5)
+    income = np.round(np.exp(log_income + rng.normal(0, 0.05, len(yy1))))
+    networth = np.round(np.exp(np.repeat(rng.normal(11.5, 2, hh), 5) + rng.normal(0, 0.1, len(yy1))) - 2*10**4)
+    df = pd.DataFrame({'wgt': np.repeat(rng.lognormal(8.5, 0.8, hh), 5), 'age': age, 'married': married,
+                       'income': income, 'networth': networth, 'asset': np.maximum(networth, 0)*1.3,
+                       'wageinc': np.round(income*rng.uniform(0.5, 1, len(yy1)))},
+                      index=pd.MultiIndex.from_arrays([yy1, y1], names=['yy1', 'y1']))
+    #loans are held by household: slot k is used only if slot k-1 is.
+    held = np.ones(hh, dtype=bool)
+    for k, (whom, bal) in enumerate(zip(scf_data_clean.whom_list, scf_data_clean.bal_list)):
+        held &= rng.random(hh) < (loan_prob if k == 0 else 0.3)
+        df[whom] = np.repeat(np.where(held, rng.choice(whom_codes, hh, p=whom_probs), 0), 5).astype(np.int8)
+        df[bal] = np.repeat(np.where(held, rng.lognormal(9.8, 1, hh), 0), 5).astype(np.int32)
+    #the summary file's total, left in 2022 dollars (see scf_data_clean.loan_factor).
+    df['edn_inst'] = df[scf_data_clean.bal_list].sum(axis=1)*scf_data_clean.asset_adj
+    return df
+
+"""
+A Dataset whose raw data is synthetic: every derived group (loans, qctiles,
+cancellations, ...) is computed by the same code as for the real data, and
+nothing is read from or written to the cache.
+"""
+
+class SyntheticDataset(scf_data_clean.Dataset):
+    def __init__(self, rows, seed=0, year=2019):
+        super().__init__(year)
+        self.rows, self.seed = rows, seed
+
+    @scf_data_clean.cached
+    def base(self):
+        return synthetic_base(self.rows, self.seed)
+
+    @scf_data_clean.cached
+    def data(self):
+        return self.clean()
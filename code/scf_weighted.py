@@ -0,0 +1,102 @@
+"""
+Weighted sums, means, medians and shares by group, and weighted cross-tabs.
+
+Replaces groupby(...).agg(lambda x: np.average(x, weights=df.loc[x.index,'wgt']))
+and the analogous medians. Rows are mapped once to integer group codes (the
+codes of categorical keys, or the sorted unique values of other keys) and every
+statistic is then a sum over those codes (np.bincount, or one pass over all the
+columns with scf_kernels), or one grouped_quantile for medians. "by" may be one
+column or a list of columns, in which case the result covers every combination
+of their levels. "values" may be one column (returns a Series) or a list of
+columns (returns a DataFrame), as with groupby.
+
+Rows with a missing key are dropped, and groups with no rows (e.g. categories
+that are not observed among borrowers) are NaN, so the result always has one
+entry per category.
+"""
+import numpy as np
+import pandas as pd
+import scf_data_clean, scf_kernels
+
+"""
+Integer code of each row's group (-1 if any key is missing) and the index
+of the result.
+"""
+
+def group_index(df, by):
+    by = [by] if isinstance(by, str) else list(by)
+    codes, levels = [], []
+    for key in by:
+        if isinstance(df[key].dtype, pd.CategoricalDtype):
+            codes.append(np.asarray(df[key].cat.codes))
+            levels.append(df[key].cat.categories)
+        else:
+            c, u = pd.factorize(df[key], sort=True)
+            codes.append(c)
+            levels.append(u)
+    shape = tuple(len(level) for level in levels)
+    valid = np.all([c >= 0 for c in codes], axis=0)
+    flat = np.ravel_multi_index([np.where(valid, c, 0) for c in codes], shape)
+    flat = np.where(valid, flat, -1)
+    if len(by) == 1:
+        index = pd.Index(levels[0], name=by[0])
+    else:
+        index = pd.MultiIndex.from_product(levels, names=by)
+    return flat, index
+
+def _result(columns, index, values):
+    if isinstance(values, str):
+        return pd.Series(columns[values], index=index, name=values)
+    return pd.DataFrame(columns, index=index, columns=values)
+
+#total weight and weighted sum of each column by group (see scf_kernels.group_sums).
+def _sums(df, by, values, weight):
+    codes, index = group_index(df, by)
+    names = [values] if isinstance(values, str) else list(values)
+    x = np.column_stack([np.asarray(df[var], dtype=float) for var in names]) if names else np.empty((len(df), 0))
+    total, sums = scf_kernels.group_sums(codes, df[weight], x, len(index))
+    return index, names, total, sums
+
+def weighted_sum(df, by, values, weight='wgt'):
+    index, names, total, sums = _sums(df, by, values, weight)
+    return _result({var: sums[:,k] for k, var in enumerate(names)}, index, values)
+
+def weighted_mean(df, by, values, weight='wgt'):
+    index, names, total, sums = _sums(df, by, values, weight)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return _result({var: sums[:,k]/total for k, var in enumerate(names)}, index, values)
+
+def weighted_median(df, by, values, weight='wgt'):
+    codes, index = group_index(df, by)
+    columns = {}
+    for var in ([values] if isinstance(values, str) else values):
+        columns[var] = scf_data_clean.grouped_quantile(df[var], df[weight], codes, 0.5, len(index))[:,0]
+    return _result(columns, index, values)
+
+#Fraction of the total weight (of rows with a valid key) in each group.
+def weighted_share(df, by, weight='wgt'):
+    codes, index = group_index(df, by)
+    keep = codes >= 0
+    total = np.bincount(codes[keep], weights=np.asarray(df[weight], dtype=float)[keep], minlength=len(index))
+    return pd.Series(total/total.sum(), index=index, name=weight)
+
+"""
+Weighted 2-D histogram: the total weight in each (row, column) cell, as a dense
+(nrows x ncols) array with zeros for empty cells. rows and cols are categoricals
+(e.g. from pd.cut) or integer codes; rows with a missing code are dropped. shape
+defaults to the number of categories (or the largest code plus one).
+"""
+
+def _codes(x):
+    if isinstance(getattr(x, 'dtype', None), pd.CategoricalDtype):
+        x = pd.Categorical(x)
+        return np.asarray(x.codes, dtype=np.int64), len(x.categories)
+    x = np.asarray(x, dtype=np.int64)
+    return x, (x.max() + 1 if len(x) else 0)
+
+def weighted_crosstab(rows, cols, weights, shape=None):
+    (i, nrows), (j, ncols) = _codes(rows), _codes(cols)
+    nrows, ncols = (nrows, ncols) if shape is None else shape
+    keep = (i >= 0) & (j >= 0) & (i < nrows) & (j < ncols)
+    w = np.asarray(weights, dtype=float)[keep]
+    return np.bincount(i[keep]*ncols + j[keep], weights=w, minlength=nrows*ncols).reshape(nrows, ncols)
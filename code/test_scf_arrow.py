@@ -0,0 +1,53 @@
+"""
+Tests of the Arrow export (scf_arrow) on synthetic data:
+
+    python -m pytest test_scf_arrow.py
+"""
+import os, sys, subprocess
+import numpy as np
+import pandas as pd
+import pytest
+import scf_arrow, scf_synthetic
+
+@pytest.fixture(scope='module')
+def data():
+    return scf_synthetic.SyntheticDataset(1000).data
+
+@pytest.fixture(scope='module')
+def exported(data, tmp_path_factory):
+    out = tmp_path_factory.mktemp('arrow')
+    specs = [{'name': 'table', 'table': np.arange(12.0).reshape(3, 4)}, {'name': 'row', 'table': [1.5, np.nan]}]
+    return scf_arrow.export(specs, {2019: data}, str(out), {2019: 'key'})
+
+def test_dataset_round_trip(data, exported):
+    path = exported[0]
+    assert scf_arrow.header(path)['cache_key'] == 'key'
+    pd.testing.assert_frame_equal(scf_arrow.open_dataset(path).to_pandas(), data)
+    arrays, categories = scf_arrow.read_columns(path, ['wgt', 'income_cat52', 'percap_income_cat5'])
+    assert np.array_equal(arrays['wgt'], data['wgt'].values)
+    for col in ['income_cat52', 'percap_income_cat5']:
+        #age-specific qctiles are missing outside their bracket: code -1, as in pandas.
+        assert np.array_equal(arrays[col], data[col].cat.codes.values)
+        assert list(categories[col]) == list(data[col].cat.categories)
+    assert (arrays['income_cat52'] == -1).any()
+
+def test_tables_round_trip(exported):
+    path = exported[1]
+    assert scf_arrow.table_names(path) == ['table', 'row']
+    assert np.array_equal(scf_arrow.read_table(path, 'table'), np.arange(12.0).reshape(3, 4))
+    assert np.array_equal(scf_arrow.read_table(path, 'row'), [1.5, np.nan], equal_nan=True)
+
+def test_other_version_is_refused(data, tmp_path, monkeypatch):
+    path = str(tmp_path / 'v2.arrow')
+    monkeypatch.setattr(scf_arrow, 'format_version', scf_arrow.format_version + 1)
+    scf_arrow.write_dataset(data.iloc[:10], path)
+    monkeypatch.undo()
+    with pytest.raises(ValueError, match='version'):
+        scf_arrow.read_columns(path)
+
+def test_readers_do_not_import_pandas(exported):
+    code = ("import sys, scf_arrow; scf_arrow.read_columns({0!r}, ['wgt', 'income_cat52']); "
+            "scf_arrow.read_table({1!r}, 'table'); print('pandas' in sys.modules)").format(*exported)
+    out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True).stdout
+    assert out.split() == ['False']
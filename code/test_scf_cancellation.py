@@ -0,0 +1,33 @@
+"""
+Tests of the policy sweep (scf_cancellation) on synthetic data.
+"""
+import tracemalloc
+import numpy as np
+import pytest
+import scf_cancellation, scf_synthetic
+
+caps, phaseouts = np.arange(0, 10**5+1, 10**3), [np.inf, 125000]
+
+@pytest.fixture(scope='module')
+def data():
+    return scf_synthetic.SyntheticDataset(20000).data
+
+def test_blocks_do_not_change_the_result(data):
+    whole = scf_cancellation.simulate_cancellation(data, caps, phaseouts, block_size=len(data)*len(caps)*2)
+    blocks = scf_cancellation.simulate_cancellation(data, caps, phaseouts, block_size=1000)
+    assert np.allclose(whole.values, blocks.values, rtol=1e-12, equal_nan=True)
+
+def test_matches_forgiveness(data):
+    F = scf_cancellation.forgiveness(data, [10000])[:,0,0]
+    w, cat = data['wgt'].values, data['percap_income_cat5'].cat.codes.values
+    expected = [np.average(F[cat == q], weights=w[cat == q]) for q in range(5)]
+    assert np.allclose(scf_cancellation.simulate_cancellation(data, [10000]).values[0], expected)
+
+#the (households x policies) array alone would take 20000*202*8 bytes = 31 MB;
+#a block of 2**16 elements needs a few MB of temporaries.
+def test_memory_is_bounded_by_the_block(data):
+    tracemalloc.start()
+    scf_cancellation.simulate_cancellation(data, caps, phaseouts, block_size=2**16)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 8*2**20
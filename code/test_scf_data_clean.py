@@ -0,0 +1,149 @@
+"""
+Tests of the cleaning step (scf_data_clean) on synthetic data:
+
+    python -m pytest test_scf_data_clean.py
+"""
+import os, threading
+import numpy as np
+import requests
+import pytest
+import scf_data_clean, scf_synthetic, scf_http_fixture
+
+#load_raw stand-in: every wave waits at the barrier, which is only passed if the
+#waves are loaded at the same time.
+@pytest.fixture
+def raw(monkeypatch, tmp_path):
+    barrier, calls = threading.Barrier(2, timeout=10), []
+    def load_raw(year, cache_dir, offline):
+        calls.append(year)
+        barrier.wait()
+        df = scf_synthetic.synthetic_base(500, seed=year)
+        return df.assign(edn_inst=df['edn_inst']*scf_data_clean.wave(year)['asset_adj']/scf_data_clean.asset_adj)
+    monkeypatch.setattr(scf_data_clean, 'load_raw', load_raw)
+    monkeypatch.setattr(scf_data_clean.Dataset, 'cache_key', lambda self: 'test')
+    monkeypatch.setattr(scf_data_clean, 'datasets', {})
+    return calls, str(tmp_path)
+
+def test_waves_are_built_concurrently(raw):
+    calls, cache_dir = raw
+    built = scf_data_clean.build_datasets([2019, 2022], cache_dir=cache_dir)
+    assert sorted(calls) == [2019, 2022]
+    assert all(len(ds.data) == 500 for ds in built.values())
+
+def test_groups_are_computed_once(monkeypatch):
+    ds, calls = scf_synthetic.SyntheticDataset(500), []
+    base = scf_synthetic.synthetic_base
+    def synthetic_base(rows, seed):
+        calls.append(rows)
+        return base(rows, seed)
+    monkeypatch.setattr(scf_synthetic, 'synthetic_base', synthetic_base)
+    threads = [threading.Thread(target=lambda: ds.data) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [500]
+
+def test_cache_key_covers_the_cleaning_code(monkeypatch, tmp_path):
+    monkeypatch.setattr(scf_data_clean, 'cached_archive', lambda url, cache_dir, offline: (url, 'sha'))
+    ds = scf_data_clean.Dataset(2019, str(tmp_path))
+    key = ds.cache_key()
+    assert {'scf_kernels.py', 'scf_weighted.py'} <= set(ds.sources)
+    for name in ds.sources:
+        monkeypatch.setattr(ds, 'sources', [s for s in scf_data_clean.Dataset.sources if s != name])
+        assert ds.cache_key() != key
+
+#the 2019 and 2022 waves served over HTTP by scf_http_fixture, with an empty cache.
+@pytest.fixture
+def served(monkeypatch, tmp_path):
+    httpd = scf_http_fixture.server(str(tmp_path / 'served'))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}/'.format(httpd.server_port)
+    for year in [2019, 2022]:
+        wave = scf_data_clean.wave(year)
+        monkeypatch.setitem(scf_data_clean.waves, year, dict(wave, summary=url + os.path.basename(wave['summary']),
+                                                             full=url + os.path.basename(wave['full'])))
+        scf_http_fixture.write_archives(str(tmp_path / 'served'), year, rows=2000, seed=year)
+    monkeypatch.setattr(scf_data_clean, 'datasets', {})
+    yield tmp_path, url
+    httpd.shutdown()
+
+def test_waves_download_concurrently_into_a_cold_cache(served, monkeypatch):
+    served, url = served
+    for run in range(5):
+        monkeypatch.setattr(scf_data_clean, 'datasets', {})
+        cache_dir = str(served / 'cache{0}'.format(run))
+        built = scf_data_clean.build_datasets([2019, 2022], cache_dir=cache_dir)
+        assert all(len(ds.data) == 2000 for ds in built.values())
+        assert len(scf_data_clean.cache_index(cache_dir)) == 4
+
+#the 2019 summary archive (about 150 KB) served by scf_http_fixture, every
+#response cut after 70 KB.
+@pytest.fixture
+def dropping(tmp_path):
+    path = scf_http_fixture.write_archives(str(tmp_path / 'served'), 2019, rows=5000, seed=0)[0]
+    httpd = scf_http_fixture.server(str(tmp_path / 'served'), drop_after=70000)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}/'.format(httpd.server_port) + os.path.basename(path)
+    yield url, path, str(tmp_path / 'cache')
+    httpd.shutdown()
+
+def fetch(url, cache_dir, attempts=10):
+    for attempt in range(1, attempts + 1):
+        try:
+            return scf_data_clean.cached_archive(url, cache_dir, offline=False) + (attempt,)
+        except requests.RequestException:
+            pass
+    raise AssertionError('{0} not downloaded in {1} attempts'.format(url, attempts))
+
+def test_interrupted_download_resumes(dropping):
+    url, path, cache_dir = dropping
+    archive, sha256, attempts = fetch(url, cache_dir)
+    assert attempts == 3
+    assert sha256 == scf_data_clean.hash_file(path).hexdigest() == scf_data_clean.hash_file(archive).hexdigest()
+    assert sorted(os.listdir(cache_dir)) == sorted(['cache_index.json', sha256 + '.zip'])
+
+def test_changed_file_is_downloaded_again(dropping):
+    url, path, cache_dir = dropping
+    with pytest.raises(requests.RequestException):
+        scf_data_clean.cached_archive(url, cache_dir, offline=False)
+    #a new release of the archive: the .part file holds the start of the old one.
+    scf_http_fixture.write_archives(os.path.dirname(path), 2019, rows=5000, seed=1)
+    os.utime(path, ns=(0, 10**18))
+    archive, sha256, attempts = fetch(url, cache_dir)
+    assert sha256 == scf_data_clean.hash_file(path).hexdigest() == scf_data_clean.hash_file(archive).hexdigest()
+
+def test_complete_part_file_is_kept(dropping):
+    url, path, cache_dir = dropping
+    #a download that stopped after the last byte, before the rename (the server answers 416).
+    os.makedirs(cache_dir)
+    part, sha256, size = None, None, None
+    while part is None:
+        try:
+            part, sha256, size = scf_data_clean.download(url, cache_dir)
+        except requests.RequestException:
+            pass
+    assert scf_data_clean.download(url, cache_dir) == (part, sha256, size)
+    assert sha256 == scf_data_clean.hash_file(path).hexdigest()
+
+#a wave registered without a factor (2007) gets it from its loans.
+def test_factor_of_a_wave_is_read_off_its_loans(served, monkeypatch):
+    served, url = served
+    wave = scf_data_clean.wave(2007)
+    monkeypatch.setitem(scf_data_clean.waves, 2007, dict(wave, summary=url + os.path.basename(wave['summary']),
+                                                         full=url + os.path.basename(wave['full'])))
+    scf_http_fixture.write_archives(str(served / 'served'), 2007, rows=2000, seed=7, asset_adj=1.2345)
+    base = scf_data_clean.Dataset(2007, str(served / 'cache')).base
+    assert scf_data_clean.loan_factor(base, 2007) == 1.2345
+    expected = scf_synthetic.synthetic_base(2000, seed=7)
+    assert np.allclose(base.loc[expected.index, 'income'], expected['income'])
+
+def test_loan_codes_are_checked():
+    loans = scf_synthetic.synthetic_base(2000)
+    assert scf_data_clean.loan_factor(loans, 2019) == scf_data_clean.asset_adj
+    with pytest.raises(ValueError, match='add up'):
+        scf_data_clean.loan_factor(loans.assign(x7824=0), 2019)
+    with pytest.raises(ValueError, match='codebook'):
+        scf_data_clean.loan_factor(loans.assign(x7978=loans['x7978'].where(loans['x7978'] != 1, 9)), 2019)
+    with pytest.raises(ValueError, match='factor'):
+        scf_data_clean.loan_factor(loans, 2022)
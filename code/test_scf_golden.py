@@ -0,0 +1,14 @@
+"""
+Tests that the figure tables on the synthetic fixture still match the golden
+tables in main/golden (see scf_golden), with one process and with two:
+
+    python -m pytest test_scf_golden.py
+"""
+import os
+import pytest
+import scf_golden
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_tables_match_golden(jobs):
+    golden = scf_golden.read_tables(os.path.join(scf_golden.golden_dir, 'fixture.json'))
+    assert scf_golden.compare_tables(scf_golden.tables(scf_golden.fixture_specs(jobs)), golden) == []
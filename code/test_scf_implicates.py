@@ -0,0 +1,49 @@
+"""
+Tests of the implicate and replicate-weight estimates (scf_implicates) on
+synthetic data:
+
+    python -m pytest test_scf_implicates.py
+"""
+import numpy as np
+import pytest
+import scf_data_clean, scf_implicates, scf_synthetic, scf_weighted
+
+@pytest.fixture(scope='module')
+def data():
+    return scf_synthetic.SyntheticDataset(2000).data
+
+#the reference: grouped_quantile once per weight column.
+def by_column(values, W, groups, q, ngroups):
+    return np.stack([scf_data_clean.grouped_quantile(values, W[:,r], groups, q, ngroups) for r in range(W.shape[1])], axis=-1)
+
+def test_grouped_quantiles_match_grouped_quantile():
+    rng = np.random.default_rng(0)
+    n, ngroups, q = 3000, 7, [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1]
+    #ties in the values and weights, rows in no group, an empty group (5), and a
+    #group (4) without weight in some columns.
+    values = rng.integers(0, 20, n).astype(float)
+    groups = rng.choice([-1, 0, 1, 2, 3, 4, 6], n)
+    W = rng.integers(0, 4, (n, 25)).astype(float)
+    W[groups == 4, :3] = 0
+    expected = by_column(values, W, groups, q, ngroups)
+    for chunk in [1, 10, 100]:
+        got = scf_implicates.grouped_quantiles(values, W, groups, q, ngroups, chunk=chunk)
+        assert np.array_equal(got, expected, equal_nan=True)
+    assert np.isnan(expected[5]).all() and not np.isnan(expected[4]).any()
+
+def test_implicate_quantiles_match_grouped_quantile(data):
+    rng = np.random.default_rng(1)
+    W = scf_implicates.weight_matrix(data, rng.lognormal(8, 1, (len(data), 20))*(rng.random((len(data), 20)) < 0.6))
+    q = [0.1, 0.5, 0.9]
+    got, index = scf_implicates.implicate_quantiles(data, 'income_cat5', 'percap_income', q, W)
+    codes, index = scf_weighted.group_index(data, 'income_cat5')
+    imp = scf_implicates.implicate_codes(data)
+    expected = by_column(data['percap_income'], W, np.where(codes >= 0, imp*len(index) + codes, -1), q, 5*len(index))
+    assert np.array_equal(got, expected.reshape(got.shape), equal_nan=True)
+
+def test_estimate_quantiles(data):
+    rng = np.random.default_rng(2)
+    replicates = rng.lognormal(8, 1, (len(data), 10))
+    table = scf_implicates.estimate_quantiles(data, 'income_cat5', 'percap_income', [0.25, 0.5], replicates)
+    assert table.shape == (5, 4)
+    assert (table.xs('se', axis=1, level=1) > 0).all().all()
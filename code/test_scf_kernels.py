@@ -0,0 +1,36 @@
+"""
+Tests of the kernel backends (scf_kernels):
+
+    python -m pytest test_scf_kernels.py
+"""
+import os, sys, subprocess
+import numpy as np
+import scf_kernels
+
+#the backend, and whether Numba was imported by the import and by the first kernel call.
+def imports_numba(backend):
+    code = ("import sys, numpy, scf_kernels; imported = 'numba' in sys.modules; "
+            "scf_kernels.group_sums(numpy.zeros(3, int), numpy.ones(3), numpy.ones(3), 1); "
+            "print(scf_kernels.backend, imported, 'numba' in sys.modules)")
+    env = dict(os.environ, SCF_KERNELS=backend)
+    return subprocess.run([sys.executable, '-c', code], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                          capture_output=True, text=True, check=True).stdout.split()
+
+def test_numpy_backend_does_not_import_numba():
+    assert imports_numba('numpy') == ['numpy', 'False', 'False']
+
+def test_numba_is_imported_on_first_use():
+    backend, on_import, on_call = imports_numba('auto')
+    assert on_import == 'False' and (backend == 'numba') == (on_call == 'True')
+
+def test_backends_agree():
+    rng = np.random.default_rng(0)
+    codes, w, values = rng.integers(-1, 5, 1000), rng.random(1000), rng.normal(size=(1000, 2))
+    expected, previous = scf_kernels.np_group_sums(codes, w, values, 5), scf_kernels.backend or 'auto'
+    for name in scf_kernels.available():
+        scf_kernels.use(name)
+        try:
+            got = scf_kernels.group_sums(codes, w, values, 5)
+        finally:
+            scf_kernels.use(previous)
+        assert all(np.allclose(g, e) for g, e in zip(got, expected))
@@ -0,0 +1,39 @@
+"""
+Tests of the process pool runner (scf_parallel):
+
+    python -m pytest test_scf_parallel.py
+"""
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+import scf_parallel
+
+#a pool that runs each call when it is submitted, counting the calls.
+class Pool:
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fun, *args):
+        self.submitted += 1
+        future = Future()
+        future.set_result(fun(*args))
+        return future
+
+def test_window_bounds_tasks_in_flight():
+    pool = Pool()
+    results = scf_parallel.in_order(pool, ((lambda k: k, k) for k in range(20)), 4)
+    for k, result in enumerate(results):
+        assert result == k
+        assert pool.submitted - (k + 1) < 4
+    assert pool.submitted == 20
+
+def chunk_sum(df, start, stop):
+    return np.array([df['x'].values[start:stop].sum(), stop - start])
+
+def test_reduce_matches_one_job():
+    df = pd.DataFrame({'x': np.arange(1000.0)})
+    tasks = [(chunk_sum, {'start': a, 'stop': a + 50}) for a in range(0, 1000, 50)]
+    one = scf_parallel.run_tasks(df, ['x'], tasks, jobs=1, reduce=np.add)
+    two = scf_parallel.run_tasks(df, ['x'], tasks, jobs=2, reduce=np.add)
+    assert np.array_equal(one, two) and one[0] == df['x'].sum()
+    assert [list(r) for r in scf_parallel.run_tasks(df, ['x'], tasks, jobs=2)] == [list(chunk_sum(df, **kw)) for _, kw in tasks]
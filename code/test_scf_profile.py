@@ -0,0 +1,20 @@
+"""
+Tests of the stage instrumentation (scf_profile):
+
+    python -m pytest test_scf_profile.py
+"""
+import numpy as np
+import pandas as pd
+import scf_profile
+
+def test_profiled_records_shapes(monkeypatch):
+    monkeypatch.setattr(scf_profile, 'enabled', True)
+    monkeypatch.setattr(scf_profile, 'trace', [])
+    results = {'frame': pd.DataFrame({'a': np.zeros(1000), 'b': np.zeros(1000)}),
+               'series': pd.Series(np.zeros(1000)), 'array': np.zeros((10, 100))}
+    for name, result in results.items():
+        assert scf_profile.profiled(name)(lambda: result)() is result
+    records = {record['name']: record for record in scf_profile.trace}
+    assert records['frame']['shape'] == [1000, 2] and records['frame']['memory_mb'] == 16000/2**20
+    assert records['series']['shape'] == [1000] and records['series']['memory_mb'] == 8000/2**20
+    assert records['array']['shape'] == [10, 100] and records['array']['memory_mb'] == 8000/2**20
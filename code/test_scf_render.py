@@ -0,0 +1,32 @@
+"""
+Tests of the incremental figure builds (scf_render):
+
+    python -m pytest test_scf_render.py
+"""
+import numpy as np
+import pytest
+import scf_render
+
+@pytest.fixture
+def specs():
+    return [scf_render.spec('pair', 'pair', np.arange(6.0).reshape(3, 2), x=[1, 2, 3]),
+            scf_render.spec('shares', 'shares', np.ones((2, 4)))]
+
+def render(specs, fig_dir, **kwargs):
+    return scf_render.render(specs, 'png', fig_dir=str(fig_dir), dpi=10, **kwargs)
+
+def test_unchanged_figures_are_skipped(specs, tmp_path):
+    assert len(render(specs, tmp_path)) == 2
+    assert render(specs, tmp_path) == []
+    specs[0]['table'] = specs[0]['table'] + 1
+    assert render(specs, tmp_path) == [str(tmp_path / 'pair.png')]
+
+def test_force_redraws_every_figure(specs, tmp_path):
+    render(specs, tmp_path)
+    assert render(specs, tmp_path, force=True) == [str(tmp_path / 'pair.png'), str(tmp_path / 'shares.png')]
+
+def test_colours_are_part_of_the_version(specs, tmp_path, monkeypatch):
+    render(specs, tmp_path)
+    monkeypatch.setattr(scf_render, 'c1', 'red')
+    monkeypatch.setattr(scf_render, 'code_version', scf_render.drawing_version())
+    assert len(render(specs, tmp_path)) == 2
@@ -0,0 +1,58 @@
+"""
+Tests of the query service (scf_service) on synthetic data, over HTTP:
+
+    python -m pytest test_scf_service.py
+"""
+import json, threading
+from http.server import ThreadingHTTPServer
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+import pytest
+import scf_service, scf_synthetic
+
+@pytest.fixture(scope='module')
+def service():
+    return scf_service.Service(scf_synthetic.SyntheticDataset(1000).data)
+
+@pytest.fixture(scope='module')
+def url(service):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), scf_service.handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{0}/'.format(server.server_port)
+    server.shutdown()
+
+def request(url, body=None):
+    data = None if body is None else json.dumps(body).encode()
+    try:
+        with urlopen(Request(url, data=data), timeout=30) as r:
+            return r.status, json.load(r)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+def test_scalar_caps_get(url):
+    status, body = request(url + 'cancellation?caps=10000')
+    assert status == 200
+    assert body['result']['index'] == [[10000, None]]
+
+def test_scalar_caps_post(url, service):
+    status, body = request(url + 'cancellation', {'caps': 10000})
+    assert status == 200
+    assert body['result'] == service.query('cancellation', {'caps': [10000]})
+
+def test_scalar_caps_lifetime(url):
+    status, body = request(url + 'lifetime', {'caps': 10000})
+    assert status == 200
+    assert 'forgiven 10000 inf' in body['result']['columns']
+
+def test_bad_query_is_answered(url):
+    status, body = request(url + 'quantile?var=no_such_column&q=0.5')
+    assert status == 400
+    assert 'error' in body
+
+def test_unexpected_error_is_answered(url, service, monkeypatch):
+    def fail(endpoint, key):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(service, 'answer', fail)
+    status, body = request(url + 'columns')
+    assert status == 500
+    assert 'boom' in body['error']
@@ -0,0 +1,32 @@
+"""
+Memory of a cleaned synthetic dataset (scf_synthetic, scf_data_clean.Dataset):
+
+    python -m pytest test_scf_synthetic.py
+"""
+import gc, tracemalloc
+import numpy as np
+import scf_synthetic
+
+rows = 50000
+
+#memory traced while cleaning (peak) and held afterwards, against "data" itself.
+def test_memory_ceiling():
+    scf_synthetic.SyntheticDataset(100).data
+    tracemalloc.start()
+    try:
+        ds = scf_synthetic.SyntheticDataset(rows)
+        data = ds.data
+        gc.collect()
+        held, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    size = data.memory_usage(index=True, deep=True).sum()
+    assert peak < 2*size
+    assert held < 1.4*size
+
+def test_groups_are_released():
+    ds = scf_synthetic.SyntheticDataset(1000)
+    data = ds.data
+    assert not set(ds.groups) & set(ds.__dict__)
+    #a released group is rebuilt when read again.
+    assert np.array_equal(ds.loans['all_loans'].values, data['all_loans'].values)